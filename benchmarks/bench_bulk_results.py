@@ -0,0 +1,142 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Compare the old line-based bulk result parser with the incremental one on a generated result file.
+#
+#   python benchmarks/bench_bulk_results.py [--mb N] [--columns N] [--long-text N] [--file PATH]
+#
+# A Bulk API JSON result of about N megabytes is written to a temporary file (or PATH, which is kept)
+# in Salesforce's pretty-printed layout and parsed by both, reading 64KB chunks as from the network.
+#
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+# run from a checkout without installing gurglefish
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gurglefish import fastjson
+from gurglefish.sfapi import STREAM_CHUNK_SIZE
+
+
+def write_results(path: str, megabytes: int, columns: int, long_text: int) -> int:
+    target = megabytes * 1024 * 1024
+    count = 0
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('[ ')
+        while out.tell() < target:
+            rec = {'attributes': {'type': 'Account', 'url': f'/services/data/v44.0/sobjects/Account/{count}'},
+                   'Id': '001{:015d}'.format(count), 'SystemModstamp': 1546300800000 + count}
+            for c in range(columns):
+                if c % 3 == 0:
+                    rec[f'Text{c}__c'] = f'value {count} {c} with "quotes", {{braces}} and [brackets]'
+                elif c % 3 == 1:
+                    rec[f'Amount{c}__c'] = count * 1.5
+                else:
+                    rec[f'Flag{c}__c'] = None
+            if long_text > 0:
+                rec['Description'] = 'Lorem ipsum dolor sit amet. ' * (long_text // 28)
+            if count > 0:
+                out.write(', ')
+            # same layout as Salesforce: 2 space indent, one field per line
+            out.write(json.dumps(rec, indent=2, separators=(',', ' : ')))
+            count += 1
+        out.write(' ]\n')
+    return count
+
+
+def chunks(path: str):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(STREAM_CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+
+def lines(path: str):
+    # what Response.iter_lines() gave the old parser
+    with open(path, 'rb') as f:
+        for line in f:
+            yield line.rstrip(b'\r\n')
+
+
+def parse_lines(path: str):
+    # the parser JobBatch.get_results used before, for comparison
+    doc = ''
+    for chunk in lines(path):
+        if chunk is None:
+            continue
+        chunk = chunk.decode('utf-8')
+        if chunk[0] == '[':
+            doc = '{'
+        elif chunk[0] == '}':
+            doc += '}'
+            yield json.loads(doc)
+            doc = '{'
+        else:
+            doc += chunk
+
+
+def parse_stream(path: str):
+    return fastjson.iter_items(chunks(path))
+
+
+def run(label: str, records, size: int):
+    start = time.perf_counter()
+    count = 0
+    for _ in records:
+        count += 1
+    elapsed = time.perf_counter() - start
+    print('{:<24} {:>9} records {:>8.2f}s {:>8.1f} MB/sec {:>10.0f} records/sec'.format(
+        label, count, elapsed, size / 1024 / 1024 / elapsed, count / elapsed))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mb', type=int, default=300, help='size of the result file to generate')
+    parser.add_argument('--columns', type=int, default=60)
+    parser.add_argument('--long-text', type=int, default=0, help='add a text field of this many characters')
+    parser.add_argument('--file', help='write the results here and keep them')
+    args = parser.parse_args()
+
+    path = args.file or tempfile.mkstemp(suffix='.json')[1]
+    try:
+        count = write_results(path, args.mb, args.columns, args.long_text)
+        size = os.path.getsize(path)
+        print(f'{count} records, {size / 1024 / 1024:.0f} MB')
+
+        expected = run('line parser (old)', parse_lines(path), size)
+        for name in fastjson.DECODERS:
+            fastjson.use(name)
+            found = run(f'incremental ({name})', parse_stream(path), size)
+            assert found == expected == count
+        print(f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB')
+    finally:
+        if args.file is None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Compare writing export lines through parse() and format_for_export() with the fused copy_line() the
+# transformer generates, on a synthetic sobject.
+#
+#   python benchmarks/bench_export_format.py [--columns N] [--records N] [--seed N]
+#
+# Both must produce the same bytes for every record, which include missing values, text that needs
+# escaping or cutting down and numbers too long for their column.
+#
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# run from a checkout without installing gurglefish
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gurglefish.drivers.postgresql.Driver import Driver, NativeExporter
+from gurglefish.objects.sobject import ColumnMap
+
+TYPES = ['string', 'string', 'textarea', 'picklist', 'reference', 'datetime', 'date', 'double', 'currency',
+         'boolean', 'int', 'time']
+
+
+def make_columns(count: int):
+    columns = [ColumnMap.from_parts(18, 'char(15) primary key', 'bench', 'Id', 'Id', 'id')]
+    for i in range(1, count):
+        fieldtype = TYPES[i % len(TYPES)]
+        name = f'Field{i}__c'
+        fieldlen = {'string': 80, 'textarea': 255, 'picklist': 40, 'reference': 18, 'double': 19}.get(fieldtype, 0)
+        columns.append(ColumnMap.from_parts(fieldlen, '', 'bench', name, name, fieldtype))
+    return columns
+
+
+def make_value(fieldtype: str, rnd: random.Random):
+    if rnd.random() < 0.2:
+        return None
+    if fieldtype in ('string', 'textarea', 'picklist'):
+        roll = rnd.random()
+        if roll < 0.05:
+            return 'line one\nline two\twith a tab and a \\ backslash'
+        if roll < 0.1:
+            return 'Ünïcödé text ' * rnd.randrange(1, 30)
+        return 'value ' * rnd.randrange(1, 20)
+    if fieldtype == 'reference':
+        return '001{:012d}AAA'.format(rnd.randrange(0, 10 ** 12))
+    if fieldtype == 'datetime':
+        stamp = datetime(2000, 1, 1) + timedelta(seconds=rnd.randrange(0, 20 * 365 * 86400))
+        return stamp.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+    if fieldtype == 'date':
+        return (datetime(2000, 1, 1) + timedelta(days=rnd.randrange(0, 7000))).strftime('%Y-%m-%d')
+    if fieldtype == 'time':
+        return '{:02d}:{:02d}:{:02d}.000Z'.format(rnd.randrange(24), rnd.randrange(60), rnd.randrange(60))
+    if fieldtype in ('double', 'currency'):
+        return round(rnd.uniform(0, 1_000_000), 2) if rnd.random() < 0.9 else rnd.uniform(0, 1)
+    if fieldtype == 'boolean':
+        return rnd.random() < 0.5
+    return rnd.randrange(0, 100_000)
+
+
+def make_records(columns: [ColumnMap], count: int, rnd: random.Random):
+    records = list()
+    for i in range(count):
+        rec = {'attributes': {'type': 'Bench__c'}, 'Id': '001{:012d}AAA'.format(i)}
+        for col in columns[1:]:
+            rec[col.sobject_field] = make_value(col.field_type, rnd)
+        records.append(rec)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--columns', type=int, default=200)
+    parser.add_argument('--records', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    columns = make_columns(args.columns)
+    records = make_records(columns, args.records, random.Random(args.seed))
+    handler = dict()
+    exec(compile(Driver().make_transformer('bench', 'bench', columns), 'bench_Transform.py', 'exec'), handler)
+    tablefields = [{'column_name': col.db_field.lower()} for col in columns]
+    fieldmap = dict((col.db_field.lower(), col) for col in columns)
+    assert handler['COPY_COLUMNS'] == tuple(tf['column_name'] for tf in tablefields)
+
+    parse = handler['parse']
+    copy_line = handler['copy_line']
+    for rec in records:
+        expected = NativeExporter.format_for_export(parse(rec), tablefields, fieldmap)
+        buf = bytearray()
+        copy_line(rec, buf)
+        if buf != expected:
+            raise AssertionError(f'{rec["Id"]}: copy_line gave\n{bytes(buf)}\nexpected\n{expected}')
+    print(f'{args.records} records of {args.columns} columns written the same both ways')
+
+    start = time.perf_counter()
+    buf = bytearray()
+    for rec in records:
+        buf += NativeExporter.format_for_export(parse(rec), tablefields, fieldmap)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    buf = bytearray()
+    for rec in records:
+        copy_line(rec, buf)
+    after = time.perf_counter() - start
+
+    print('{:<32} {:>10.0f} rows/sec'.format('parse + format_for_export', args.records / before))
+    print('{:<32} {:>10.0f} rows/sec {:>7.1f}x'.format('copy_line', args.records / after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Check the type conversions in transformutils against the strptime/Decimal versions they replaced, then
+# time both on synthetic Salesforce values.
+#
+#   python benchmarks/bench_transformutils.py [--values N] [--seed N]
+#
+# Every converted value must be equal to what the old function gave, except for numbers that already fit
+# their column. The old db() cut those from the exact binary expansion of the float, so 0.3 came back as
+# 0.2999999999999999 and, in a 7 character column, 9605.82 as 9605.81. They are now returned as they are,
+# and the output counts how many of them the old function changed.
+#
+
+import argparse
+import decimal
+import os
+import random
+import sys
+import time as clock
+from datetime import datetime, date, time, timedelta
+
+# run from a checkout without installing gurglefish
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gurglefish import transformutils
+
+
+# the functions as they were, for comparison
+
+def old_py_timestamp(t) -> datetime:
+    return datetime.strptime(t[0:19], '%Y-%m-%dT%H:%M:%S')
+
+
+def old_py_date(d) -> date:
+    return datetime.strptime(d, '%Y-%m-%d').date()
+
+
+def old_py_time(t) -> time:
+    return datetime.strptime(t[0:8], "%H:%M:%S").time()
+
+
+def old_truncate_number(value, fieldlen):
+    d = decimal.Decimal(value)
+    s = str(d)
+    if 0 < fieldlen < len(s):
+        return float(s[0:fieldlen])
+    return value
+
+
+def make_values(count: int, rnd: random.Random):
+    start = datetime(1995, 1, 1)
+    timestamps = list()
+    dates = list()
+    times = list()
+    amounts = list()
+    measurements = list()
+    for i in range(count):
+        stamp = start + timedelta(seconds=rnd.randrange(0, 30 * 365 * 86400), milliseconds=rnd.randrange(0, 1000))
+        timestamps.append(stamp.strftime('%Y-%m-%dT%H:%M:%S.') + f'{stamp.microsecond // 1000:03d}+0000')
+        # a few hundred distinct dates, as close dates and birthdays are
+        dates.append((start + timedelta(days=rnd.randrange(0, 400))).strftime('%Y-%m-%d'))
+        times.append(stamp.strftime('%H:%M:%S.') + f'{stamp.microsecond // 1000:03d}Z')
+        # currency amounts and counts, which nearly always fit their column
+        kind = i % 3
+        if kind == 0:
+            amounts.append(round(rnd.uniform(0, 1_000_000), 2))
+        elif kind == 1:
+            amounts.append(rnd.randrange(0, 10_000_000))
+        else:
+            # as Bulk API 2.0 CSV gives them
+            amounts.append(f'{rnd.uniform(0, 1_000_000):.2f}')
+        # calculated values with all the digits a float has, which often need cutting down
+        measurements.append(rnd.uniform(-1, 1) if i % 2 == 0 else rnd.uniform(0, 1e20))
+    return timestamps, dates, times, amounts, measurements
+
+
+def check(name: str, old, new, values, unchanged=None) -> int:
+    kept = 0
+    for value in values:
+        expected = old(value)
+        found = new(value)
+        if found == expected:
+            continue
+        if unchanged is not None and unchanged(value) and found is value:
+            kept += 1
+            continue
+        raise AssertionError(f'{name}({value!r}) gave {found!r}, expected {expected!r}')
+    print('{:<24} {:>9} values match{}'.format(name, len(values),
+                                               f', {kept} that fit kept as they are' if kept else ''))
+    return kept
+
+
+def fits(fieldlen: int):
+    def test(value) -> bool:
+        text = value if isinstance(value, str) else repr(value)
+        return len(text) <= fieldlen and 'e' not in text.lower()
+    return test
+
+
+def timed(fn, values):
+    start = clock.perf_counter()
+    for value in values:
+        fn(value)
+    elapsed = clock.perf_counter() - start
+    return elapsed
+
+
+def compare(name: str, old, new, values):
+    before = timed(old, values)
+    after = timed(new, values)
+    print('{:<24} {:>10.0f}/sec -> {:>10.0f}/sec {:>7.1f}x'.format(
+        name, len(values) / before, len(values) / after, before / after))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--values', type=int, default=200_000, help='values of each type to convert')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    timestamps, dates, times, amounts, measurements = make_values(args.values, random.Random(args.seed))
+
+    for fieldlen in (0, 7, 19):
+        check(f'truncate_number({fieldlen})', lambda v: old_truncate_number(v, fieldlen),
+              lambda v: transformutils.truncate_number(v, fieldlen), amounts + measurements, fits(fieldlen))
+    check('py_timestamp', old_py_timestamp, transformutils.py_timestamp, timestamps)
+    check('py_date', old_py_date, transformutils.py_date, dates)
+    check('py_time', old_py_time, transformutils.py_time, times)
+    print()
+
+    transformutils.py_date.cache_clear()
+    compare('py_timestamp', old_py_timestamp, transformutils.py_timestamp, timestamps)
+    compare('py_date', old_py_date, transformutils.py_date, dates)
+    compare('py_time', old_py_time, transformutils.py_time, times)
+    compare('truncate_number amounts', lambda v: old_truncate_number(v, 19),
+            lambda v: transformutils.truncate_number(v, 19), amounts)
+    compare('truncate_number floats', lambda v: old_truncate_number(v, 19),
+            lambda v: transformutils.truncate_number(v, 19), measurements)
+
+
+if __name__ == '__main__':
+    main()
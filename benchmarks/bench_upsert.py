@@ -0,0 +1,121 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# Compare the per-row upsert path with the batched one against a local database.
+#
+#   python benchmarks/bench_upsert.py <env_name> [--rows N] [--columns N] [--batch N]
+#
+# The env name is looked up in connections.ini just like the main CLI. A scratch table named
+# gf_bench_upsert is created (and dropped) in the configured schema.
+#
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+# run from a checkout without installing gurglefish
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gurglefish import tools
+
+TABLE_NAME = 'gf_bench_upsert'
+
+
+def make_records(count: int, columns: int, generation: int) -> [dict]:
+    stamp = datetime.datetime(2019, 1, 1) + datetime.timedelta(days=generation)
+    records = []
+    for i in range(count):
+        rec = {'Id': '006{:012d}'.format(i), 'SystemModstamp': stamp}
+        for c in range(columns):
+            if c % 3 == 0:
+                rec[f'Text{c}__c'] = f'value {i} {c} {generation}'
+            elif c % 3 == 1:
+                rec[f'Amount{c}__c'] = round(random.random() * 10000, 2)
+            else:
+                rec[f'Flag{c}__c'] = (i + c + generation) % 2 == 0
+        records.append(rec)
+    return records
+
+
+def create_table(db, columns: int):
+    cols = ['id char(15) primary key', 'systemmodstamp timestamp']
+    for c in range(columns):
+        if c % 3 == 0:
+            cols.append(f'text{c}__c text')
+        elif c % 3 == 1:
+            cols.append(f'amount{c}__c numeric(18,2)')
+        else:
+            cols.append(f'flag{c}__c boolean')
+    db.exec_ddl(f'drop table if exists {db.fq_table(TABLE_NAME)}')
+    db.exec_ddl(f'create table {db.fq_table(TABLE_NAME)} ({",".join(cols)})')
+
+
+def run_rows(db, records: [dict]) -> float:
+    start = time.perf_counter()
+    with db.cursor as cur:
+        for rec in records:
+            db.upsert(cur, TABLE_NAME, rec)
+    db.commit()
+    return time.perf_counter() - start
+
+
+def run_batched(db, records: [dict], batch_size: int) -> float:
+    start = time.perf_counter()
+    with db.cursor as cur:
+        for i in range(0, len(records), batch_size):
+            db.upsert_batch(cur, TABLE_NAME, records[i:i + batch_size])
+    db.commit()
+    return time.perf_counter() - start
+
+
+def report(label: str, rows: int, elapsed: float):
+    print('{:<28} {:>8} rows {:>9.2f}s {:>10.0f} rows/sec'.format(label, rows, elapsed, rows / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('env', help='Environment/DB settings name', metavar='env_name')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--columns', type=int, default=60)
+    parser.add_argument('--batch', type=int, default=2000)
+    args = parser.parse_args()
+
+    db = tools.get_db_connection(args.env)
+    try:
+        inserts = make_records(args.rows, args.columns, 0)
+        updates = make_records(args.rows, args.columns, 1)
+
+        create_table(db, args.columns)
+        report('per-row insert', args.rows, run_rows(db, inserts))
+        report('per-row update', args.rows, run_rows(db, updates))
+        report('per-row no-op', args.rows, run_rows(db, updates))
+
+        create_table(db, args.columns)
+        report('batched insert', args.rows, run_batched(db, inserts, args.batch))
+        report('batched update', args.rows, run_batched(db, updates, args.batch))
+        report('batched no-op', args.rows, run_batched(db, updates, args.batch))
+    finally:
+        db.exec_ddl(f'drop table if exists {db.fq_table(TABLE_NAME)}')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -19,11 +19,15 @@ import datetime
 import os
 import pkgutil
 from abc import ABCMeta, abstractmethod
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 
+from gurglefish.objects.checkpoint import SyncCheckpoint
 from gurglefish.objects.connections import ConnectionConfig
 from gurglefish.objects.sobject import ColumnMap, SObjectFields
 
+# optional column holding a hash of the transformed record, maintained by gurglefish
+ROW_HASH_COLUMN = 'gf_row_hash'
+
 
 class GetDbTablesResult(object):
 
@@ -50,6 +54,52 @@ class DbNativeExporter(object):
     def write(self, record: Dict):
         pass
 
+    @abstractmethod
+    def write_bulk(self, record: Dict):
+        """
+        Write a record from bulk API (1.0) query results, which are typed differently than REST results.
+        """
+        pass
+
+    @abstractmethod
+    def write_csv(self, record: Dict):
+        """
+        Write a record from bulk API 2.0 CSV query results, where every value is a string.
+        """
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class DbSyncWriter(object):
+    __metaclass__ = ABCMeta
+
+    @property
+    @abstractmethod
+    def pending(self) -> int:
+        pass
+
+    @abstractmethod
+    def write(self, trec: Dict):
+        pass
+
+    @abstractmethod
+    def write_columns(self, columns: Dict[str, List]):
+        """
+        Write a page of records given as one list of values per field, from a transformer's parse_page().
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def flush(self) -> (int, int, int, int):
+        pass
+
     @abstractmethod
     def close(self):
         pass
@@ -62,10 +112,21 @@ class DbDriverMeta(object):
     def connect(self, env: ConnectionConfig):
         pass
 
+    @abstractmethod
+    def reconnect(self):
+        """
+        Connect again if the connection was lost, otherwise roll back any failed transaction.
+        """
+        pass
+
     @abstractmethod
     def create_exporter(self, sobject_name: str, ctx, just_sample=False, timestamp=None) -> DbNativeExporter:
         pass
 
+    @abstractmethod
+    def create_sync_writer(self, cur, sobject_name: str, ctx, batch_size: int, staged=False) -> DbSyncWriter:
+        pass
+
     @abstractmethod
     def get_db_tables(self)-> List[GetDbTablesResult]:
         pass
@@ -118,14 +179,33 @@ class DbDriverMeta(object):
     def get_table_fields(self, table_name: str):
         pass
 
+    @abstractmethod
+    def clear_table_cache(self):
+        """
+        Forget the table columns read so far, after they were changed here or possibly by another process.
+        """
+        pass
+
     @abstractmethod
     def delete(self, cur, table_name: str, key: str):
         pass
 
+    @abstractmethod
+    def delete_batch(self, cur, table_name: str, keys: [str]) -> int:
+        pass
+
     @abstractmethod
     def upsert(self, cur, table_name: str, trec: dict, journal=None):
         pass
 
+    @abstractmethod
+    def upsert_batch(self, cur, table_name: str, trecs: [dict], journal=None) -> (int, int):
+        pass
+
+    @abstractmethod
+    def upsert_rows(self, cur, table_name: str, names: [str], rows: [tuple], journal=None) -> (int, int):
+        pass
+
     @abstractmethod
     def import_native(self, tablename: str):
         pass
@@ -134,6 +214,16 @@ class DbDriverMeta(object):
     def export_native(self, table_name, output_path):
         pass
 
+    @abstractmethod
+    def import_csv(self, table_name: str, columns: [str], source) -> int:
+        """
+        Load CSV read from a file-like source, with no header line, into the named columns of a table
+        in one transaction.
+
+        :return: number of rows loaded
+        """
+        pass
+
     @abstractmethod
     def start_sync_job(self):
         pass
@@ -143,7 +233,46 @@ class DbDriverMeta(object):
         pass
 
     @abstractmethod
-    def insert_sync_stats(self, jobid, table_name, sync_start, sync_end, sync_since, inserts, updates, deletes, api_calls):
+    def insert_sync_stats(self, jobid, table_name, sync_start, sync_end, sync_since, inserts, updates, deletes, api_calls,
+                          noops=0):
+        pass
+
+    @abstractmethod
+    def lock_table(self, table_name: str, shared: bool = False) -> bool:
+        """
+        Try to take a lock, held by this connection until unlock_table(), that keeps other syncs of the table
+        from running at the same time, in this or any other process.
+
+        :param shared: allow other shared holders, for workers syncing parts of the same table
+        :return: False if the table is already locked
+        """
+        pass
+
+    @abstractmethod
+    def unlock_table(self, table_name: str, shared: bool = False):
+        pass
+
+    @abstractmethod
+    def get_checkpoint(self, table_name: str, scope: str) -> Optional[SyncCheckpoint]:
+        pass
+
+    @abstractmethod
+    def list_checkpoints(self, table_name: str, scope_prefix: str) -> List[SyncCheckpoint]:
+        pass
+
+    @abstractmethod
+    def save_checkpoint(self, cur, checkpoint: SyncCheckpoint):
+        pass
+
+    @abstractmethod
+    def clear_checkpoint(self, cur, table_name: str, scope: str):
+        pass
+
+    @abstractmethod
+    def get_sync_history(self, runs: int = 10) -> Dict[str, Tuple[float, float]]:
+        """
+        Average sync duration in seconds and number of records written, per table, over its most recent jobs.
+        """
         pass
 
     @abstractmethod
@@ -158,6 +287,10 @@ class DbDriverMeta(object):
     def alter_table_add_columns(self, new_field_defs, sobject_name: str) -> [ColumnMap]:
         pass
 
+    @abstractmethod
+    def enable_row_hash(self, table_name: str):
+        pass
+
     @abstractmethod
     def cursor(self):
         pass
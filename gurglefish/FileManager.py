@@ -16,16 +16,23 @@
 #    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
 
 import gzip
+import hashlib
+import importlib.util
 import json
+import marshal
 import os
 import sys
-from typing import Optional
+import types
+from typing import Dict, Optional, Tuple
 
 from gurglefish.objects.files import LocalTableConfig
 from gurglefish.objects.sobject import ColumnMap
 
 from gurglefish.sfapi import SObjectFields
 
+# transformer modules already loaded in this process, with the hash they were loaded for, by source file
+_handlers: Dict[str, Tuple[bytes, types.ModuleType]] = dict()
+
 
 class FileManager(object):
 
@@ -78,9 +85,52 @@ class FileManager(object):
         return os.listdir(self.exportdir)
 
     def load_translate_handler(self, sobject_name):
-        import importlib.machinery
-        loader = importlib.machinery.SourceFileLoader(sobject_name, os.path.join(self.schemadir, sobject_name, '{}_Transform.py'.format(sobject_name)))
-        handler = loader.load_module(sobject_name)
+        """
+        The transformer module of an sobject, compiled once per process.
+
+        Handlers are cached by a hash of the column map and the transformer source, so a regenerated
+        transformer is picked up on next use. The compiled code is also saved next to the source, to be
+        reused by other processes and later runs until the transformer changes.
+        """
+        sobject_name = sobject_name.lower()
+        sobject_dir = os.path.join(self.schemadir, sobject_name)
+        source_file = os.path.join(sobject_dir, '{}_Transform.py'.format(sobject_name))
+        with open(source_file, 'rb') as parserfile:
+            source = parserfile.read()
+        digest = hashlib.sha1(source)
+        try:
+            with open(os.path.join(sobject_dir, '{}_map.json'.format(sobject_name)), 'rb') as mapfile:
+                digest.update(mapfile.read())
+        except FileNotFoundError:
+            pass
+        key = digest.hexdigest().encode('ascii')
+
+        cached = _handlers.get(source_file)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        code_file = os.path.join(sobject_dir, '{}_Transform.code'.format(sobject_name))
+        header = importlib.util.MAGIC_NUMBER + key
+        code = None
+        try:
+            with open(code_file, 'rb') as codefile:
+                saved = codefile.read()
+            if saved.startswith(header):
+                code = marshal.loads(saved[len(header):])
+        except (OSError, ValueError, EOFError, TypeError):
+            code = None
+        if code is None:
+            code = compile(source, source_file, 'exec')
+            # written under another name first as other workers may be loading it
+            temp_file = f'{code_file}.{os.getpid()}'
+            with open(temp_file, 'wb') as codefile:
+                codefile.write(header + marshal.dumps(code))
+            os.replace(temp_file, code_file)
+
+        handler = types.ModuleType(sobject_name)
+        handler.__file__ = source_file
+        exec(code, handler.__dict__)
+        _handlers[source_file] = (key, handler)
         return handler
 
     def get_sobject_fields(self, sobject_name: str) -> Optional[SObjectFields]:
@@ -126,6 +176,7 @@ class FileManager(object):
         os.makedirs(os.path.join(self.schemadir, sobject_name), exist_ok=True)
         with open(os.path.join(self.schemadir, sobject_name, '{}_map.json'.format(sobject_name)), 'w') as mapfile:
             mapfile.write(json.dumps([f.as_dict() for f in fieldmap], indent=4))
+        self.drop_translate_handler(sobject_name)
 
     def get_sobject_query(self, sobject_name: str):
         sobject_name = sobject_name.lower()
@@ -144,6 +195,18 @@ class FileManager(object):
         with open(os.path.join(self.schemadir, sobject_name, '{}_Transform.py'.format(sobject_name)),
                   'w') as parserfile:
             parserfile.write(xformr)
+        self.drop_translate_handler(sobject_name)
+
+    def drop_translate_handler(self, sobject_name: str):
+        """
+        Forget the compiled transformer of an sobject, after the transformer or its column map changed.
+        """
+        sobject_name = sobject_name.lower()
+        _handlers.pop(os.path.join(self.schemadir, sobject_name, '{}_Transform.py'.format(sobject_name)), None)
+        try:
+            os.remove(os.path.join(self.schemadir, sobject_name, '{}_Transform.code'.format(sobject_name)))
+        except FileNotFoundError:
+            pass
 
     def save_sobject_query(self, sobject_name: str, soql: str):
         sobject_name = sobject_name.lower()
@@ -0,0 +1,160 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from gurglefish import fastjson
+from gurglefish.sfapi import SFClient, backoff_delay, is_retryable, IDEMPOTENT_METHODS, _API_VERSION
+
+__author__ = 'Marshall L Smith Jr'
+
+
+def connect_failed(ex: Exception) -> bool:
+    """
+    True if a request failed before it reached Salesforce, so it is safe to send again whatever it does.
+    """
+    # aiohttp 3.10 and later tell a connect timeout from a read timeout
+    return isinstance(ex, (aiohttp.ClientConnectorError, getattr(aiohttp, 'ConnectionTimeoutError', ())))
+
+
+def available() -> bool:
+    """
+    True if aiohttp is installed (pip install gurglefish[async]).
+    """
+    return aiohttp is not None
+
+
+class AsyncSFClient:
+    """
+    Sends many small REST calls of a logged in SFClient at once, such as the record counts taken before a
+    sync, with at most concurrency of them in flight. The token, API governor and retry settings are those
+    of the SFClient, and an expired token is renewed through it, so both go on with the new one.
+
+        async with AsyncSFClient(sf, env.api_concurrency) as client:
+            counts = await asyncio.gather(*[client.record_count(name) for name in names])
+        sf.calls += client.calls
+    """
+
+    def __init__(self, sfclient: SFClient, concurrency: int = 20):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for async Salesforce access - pip install gurglefish[async]')
+        self.log = logging.getLogger('salesforce')
+        self.sfclient = sfclient
+        self.concurrency = concurrency
+        self.calls = 0
+        self._session: Optional['aiohttp.ClientSession'] = None
+        self._limit: Optional[asyncio.Semaphore] = None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def request(self, method: str, url, **kwargs) -> Tuple[int, Dict]:
+        """
+        Send a request, waiting for a free slot first, and log in again once if the session expired.
+        Dropped connections and transient errors are retried with backoff, as SFClient does.
+
+        :return: HTTP status and the decoded JSON body
+        :raises aiohttp.ClientResponseError: if the request failed
+        """
+        if self._session is None:
+            # created on first use so it belongs to the running event loop
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=60,
+                                                                                  sock_read=600))
+            self._limit = asyncio.Semaphore(self.concurrency)
+        session = self.sfclient.client
+        governor = self.sfclient.governor
+        loop = asyncio.get_event_loop()
+        async with self._limit:
+            refreshed = False
+            attempt = 0
+            while True:
+                if governor is not None:
+                    await self.admit()
+                token = session.headers.get('Authorization', None)
+                try:
+                    async with self._session.request(method, url, headers=dict(session.headers),
+                                                     **kwargs) as response:
+                        status = response.status
+                        raw = await response.read()
+                        retry_after = response.headers.get('Retry-After', None)
+                        if governor is not None:
+                            governor.observe_header(response.headers.get('Sforce-Limit-Info', None))
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as ex:
+                    if attempt >= self.sfclient.max_retries or \
+                            not (method.upper() in IDEMPOTENT_METHODS or connect_failed(ex)):
+                        raise
+                    delay = backoff_delay(attempt)
+                    self.log.warning(f'{method} {url} failed ({ex!r}), retrying in {delay:.1f}s')
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.calls += 1
+                if status in (200, 201):
+                    return status, fastjson.loads(raw)
+                body = raw.decode('utf-8', 'replace')
+                expired = status == 401 or (status == 400 and 'InvalidSessionId' in body)
+                if expired and not refreshed and await loop.run_in_executor(None, session.renew, token):
+                    refreshed = True
+                    continue
+                if attempt < self.sfclient.max_retries and is_retryable(status, body, method):
+                    delay = backoff_delay(attempt, retry_after)
+                    self.log.warning(f'{method} {url} failed ({status}), retrying in {delay:.1f}s')
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.log.error(f'{method} {url} failed: {status} {body}')
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=status,
+                                                  message=body[:200], headers=response.headers)
+
+    async def admit(self):
+        governor = self.sfclient.governor
+        while True:
+            if governor.needs_poll():
+                await asyncio.get_event_loop().run_in_executor(None, self.sfclient.poll_limits)
+            wait, paused = governor.next_wait()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if not paused:
+                return
+
+    async def record_count(self, sobject: str, query_filter: str = None) -> Optional[int]:
+        """
+        Same as SFClient.record_count().
+        """
+        soql = 'select count() from ' + sobject
+        if query_filter:
+            soql += ' where ' + query_filter
+        try:
+            _, data = await self.request('GET', f'{self.sfclient.service_url}/services/data/v{_API_VERSION}/query/',
+                                         params={'q': soql})
+        except aiohttp.ClientResponseError:
+            return None
+        return data['totalSize']
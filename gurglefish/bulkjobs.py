@@ -0,0 +1,125 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import time
+from multiprocessing import Queue
+from typing import Dict, List, Tuple
+
+from gurglefish import sfapi
+from gurglefish.context import Context
+from gurglefish.objects.checkpoint import SyncCheckpoint, SCOPE_EXPORT
+from gurglefish.objects.files import LocalTableConfig
+from gurglefish.sfapi import BulkJob, Bulk2QueryJob
+
+__author__ = 'Marshall L Smith Jr'
+
+
+class BulkOrchestrator(object):
+    """
+    Starts the bulk query jobs of every table in an export up front, so Salesforce works on all of them at
+    once instead of one per export worker, then watches them all from one polling loop and hands each table
+    to the workers as soon as it has results to download.
+
+    Job ids are saved in the export checkpoint of their table, which is how the worker picks the job up.
+    """
+
+    def __init__(self, context: Context):
+        self.context = context
+        self.log = logging.getLogger('bulkjobs')
+        # job ids being waited on, with the bulk api version of each, by table name
+        self.waiting: Dict[str, Tuple[str, int]] = dict()
+
+    def submit(self, tables: List[LocalTableConfig]) -> List[str]:
+        """
+        Start (or find the unfinished) bulk query job of each table.
+
+        :return: names of the tables now waiting on a job
+        """
+        sfclient = self.context.sfclient
+        db = self.context.dbdriver
+        filemgr = self.context.filemgr
+        for table in tables:
+            name = table.name.lower()
+            version = table.bulkapi_version
+            checkpoint = db.get_checkpoint(name, SCOPE_EXPORT)
+            if checkpoint is not None and checkpoint.bulk_job_id is not None:
+                if version == 2:
+                    state = sfclient.bulk2_job_state(checkpoint.bulk_job_id)
+                    resumable = state in Bulk2QueryJob.STATES_ACTIVE
+                else:
+                    state = sfclient.bulk_job_state(checkpoint.bulk_job_id)
+                    resumable = state in ('Open', 'Closed', 'InProgress')
+                if resumable:
+                    self.waiting[name] = (checkpoint.bulk_job_id, version)
+                    continue
+
+            try:
+                soql = filemgr.get_sobject_query(name)
+            except OSError:
+                # no schema yet, the export worker creates the table and runs its own job
+                continue
+            if version == 2:
+                job_id = sfclient.create_query_job(soql).job_id
+            else:
+                total_size = sfclient.record_count(name)
+                if 0 < table.pk_chunk_threshold < total_size:
+                    sfclient.add_header('Sforce-Enable-PKChunking', f'chunkSize={table.pk_chunk_size}')
+                try:
+                    job = sfclient.create_job(BulkJob.JOB_OP_QUERY, name)
+                    job.bulk_query(soql + ' ')
+                    job.close()
+                    job_id = job.job_id
+                finally:
+                    sfclient.drop_header('Sforce-Enable-PKChunking')
+
+            checkpoint = SyncCheckpoint.create(name, SCOPE_EXPORT)
+            checkpoint.bulk_job_id = job_id
+            with db.cursor as cur:
+                db.save_checkpoint(cur, checkpoint)
+            db.commit()
+            self.waiting[name] = (job_id, version)
+            self.log.info(f'Started bulk query job {job_id} for {name}')
+        return list(self.waiting.keys())
+
+    def dispatch(self, queue: Queue, just_sample=False):
+        """
+        Poll all the jobs being waited on, putting each table on the export queue once its results can be
+        downloaded (or its job has ended some other way), until none are left.
+        """
+        delay = sfapi.BULK_POLL_MIN
+        while len(self.waiting) > 0:
+            ready = [name for name, (job_id, version) in self.waiting.items() if self.is_ready(job_id, version)]
+            for name in ready:
+                self.log.info(f'Results of bulk query job for {name} are ready')
+                queue.put({'table_name': name, 'just_sample': just_sample})
+                del self.waiting[name]
+            if len(self.waiting) == 0:
+                break
+            if len(ready) > 0:
+                delay = sfapi.BULK_POLL_MIN
+            else:
+                delay = min(delay * 1.5, sfapi.BULK_POLL_MAX)
+            time.sleep(delay)
+
+    def is_ready(self, job_id: str, version: int) -> bool:
+        sfclient = self.context.sfclient
+        if version == 2:
+            return sfclient.bulk2_job_state(job_id) not in Bulk2QueryJob.STATES_RUNNING
+        batches = BulkJob({'id': job_id}, sfclient.client, sfclient.service_url).batches()
+        # the first batch is done, or the job has nothing left to run
+        return any(batch.state == 'Completed' for batch in batches) or \
+            all(batch.state not in ('Queued', 'InProgress') for batch in batches)
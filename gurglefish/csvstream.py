@@ -0,0 +1,104 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import csv
+import io
+from typing import Iterable, Iterator, List, Tuple
+
+from gurglefish.transformutils import scrub
+
+__author__ = 'Marshall L Smith Jr'
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Read-only file over an iterator of byte chunks, such as Response.iter_content(), so it can be
+    wrapped in buffered and text readers. Errors raised by the iterator pass through unchanged.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        super().__init__()
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self._pending) == 0:
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                self._pending = b''
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def text_reader(chunks: Iterable[bytes], buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> io.TextIOWrapper:
+    # newline='' leaves line breaks inside quoted values for the csv module to deal with
+    return io.TextIOWrapper(io.BufferedReader(ChunkStream(chunks), buffer_size), encoding='utf-8', newline='')
+
+
+class CopySource(object):
+    """
+    File-like CSV for COPY ... FROM STDIN WITH (FORMAT csv), written from rows of strings as COPY reads it.
+    Empty values are written unquoted so COPY loads them as NULL, the way Salesforce means them.
+
+    :param cuts: (column position, length) pairs - values in those columns are cut to that length
+    :param scrubbed: positions of text columns to clean with scrub(), after any cut
+    """
+
+    def __init__(self, rows: Iterable[List[str]], cuts: List[Tuple[int, int]] = (), scrubbed: List[int] = ()):
+        self.rows: Iterator[List[str]] = iter(rows)
+        self.cuts = list(cuts)
+        self.scrubbed = list(scrubbed)
+        self.count = 0
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text, lineterminator='\n')
+        self._pending = b''
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = io.DEFAULT_BUFFER_SIZE
+        while len(self._pending) < size and self._fill(size):
+            pass
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def _fill(self, size: int) -> bool:
+        cuts = self.cuts
+        scrubbed = self.scrubbed
+        writer = self._writer
+        text = self._text
+        for row in self.rows:
+            for pos, length in cuts:
+                row[pos] = row[pos][:length]
+            for pos in scrubbed:
+                row[pos] = scrub(row[pos])
+            writer.writerow(row)
+            self.count += 1
+            if text.tell() >= size:
+                break
+        data = text.getvalue()
+        if len(data) == 0:
+            return False
+        text.seek(0)
+        text.truncate()
+        self._pending += data.encode('utf-8')
+        return True
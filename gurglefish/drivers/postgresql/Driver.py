@@ -17,13 +17,14 @@
 
 import datetime
 import gzip
+import io
 import json
 import logging
 import operator
 import os
 import string
 import sys
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 import psycopg2
 import psycopg2.extras
@@ -33,11 +34,15 @@ from psycopg2._psycopg import connection, cursor
 from gurglefish import FileManager
 from gurglefish import config
 from gurglefish import tools
-from gurglefish.DriverManager import DbDriverMeta, GetDbTablesResult, DbNativeExporter
+from gurglefish.DriverManager import DbDriverMeta, GetDbTablesResult, DbNativeExporter, DbSyncWriter, ROW_HASH_COLUMN
+from gurglefish.objects.checkpoint import SyncCheckpoint
 from gurglefish.objects.connections import ConnectionConfig
 from gurglefish.context import Context
 from gurglefish.objects.sobject import SObjectField, SObjectFields, ColumnMap
 
+DELETE_CHUNK_SIZE = 10000
+EXPORT_BUFFER_SIZE = 256 * 1024
+
 
 class NativeExporter(DbNativeExporter):
 
@@ -55,6 +60,7 @@ class NativeExporter(DbNativeExporter):
 
         self.tablefields: Dict = self.dbdriver.get_table_fields(self.sobject_name)
         self.tablefields: List = sorted(self.tablefields.values(), key=operator.itemgetter('ordinal_position'))
+        self.with_row_hash = any(tf['column_name'] == ROW_HASH_COLUMN for tf in self.tablefields)
         soqlfields = [fm.sobject_field for fm in self.fieldmap.values()]
 
         self.query = 'select {} from {}'.format(','.join(soqlfields), self.sobject_name)
@@ -65,12 +71,24 @@ class NativeExporter(DbNativeExporter):
             self.query += ' limit 500'
         self.counter = 0
         self.export_file = gzip.open(os.path.join(filemgr.exportdir, self.sobject_name + '.exp.gz'), 'wb', compresslevel=6)
+        # lines are collected here and written to the file in blocks
+        self.buffer = bytearray()
+
+        #
+        # the transformer can write export lines directly if its columns line up with the table. Tables with
+        # row fingerprints, or changed by hand, go through the transformed values.
+        #
+        self.copy_line = None
+        columns = tuple(tf['column_name'] for tf in self.tablefields)
+        if not self.with_row_hash and getattr(self.xlate_handler, 'COPY_COLUMNS', None) == columns:
+            self.copy_line = self.xlate_handler.copy_line
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
         if self.export_file is not None:
+            self._flush()
             self.export_file.close()
             self.export_file = None
 
@@ -78,18 +96,47 @@ class NativeExporter(DbNativeExporter):
         return self.query
 
     def write(self, rec: Dict):
-        transformed: Dict = self.xlate_handler.parse(rec)
-        record = NativeExporter.format_for_export(transformed, self.tablefields, self.fieldmap)
-        self.export_file.write(record)
+        if self.copy_line is None:
+            self._write(self.xlate_handler.parse(rec))
+            return
+        self.copy_line(rec, self.buffer)
+        self.counter += 1
+        if len(self.buffer) >= EXPORT_BUFFER_SIZE:
+            self._flush()
+
+    def write_bulk(self, rec: Dict):
+        self._write(self.xlate_handler.parse_bulk(rec))
+
+    def write_csv(self, rec: Dict):
+        if self.copy_line is None:
+            self._write(self.xlate_handler.parse_csv(rec))
+            return
+        # COPY reads the text of booleans and numbers as it is
+        self.copy_line(rec, self.buffer)
         self.counter += 1
+        if len(self.buffer) >= EXPORT_BUFFER_SIZE:
+            self._flush()
+
+    def _write(self, transformed: Dict):
+        if self.with_row_hash:
+            transformed[ROW_HASH_COLUMN] = self.xlate_handler.fingerprint(transformed)
+        self.buffer += NativeExporter.format_for_export(transformed, self.tablefields, self.fieldmap)
+        self.counter += 1
+        if len(self.buffer) >= EXPORT_BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self.export_file.write(self.buffer)
+        del self.buffer[:]
 
     @staticmethod
     def format_for_export(trec: Dict, tablefields: [Dict], fieldmap: Dict[str, ColumnMap]):
         parts = []
         for tf in tablefields:
             n = tf['column_name']
-            f = fieldmap[n]
-            soqlf = f.sobject_field
+            f = fieldmap.get(n)
+            # columns maintained by gurglefish are not in the map and use the column name as-is
+            soqlf = f.sobject_field if f is not None else n
             if soqlf in trec:
                 val = trec[soqlf]
                 if val is None:
@@ -117,11 +164,148 @@ class NativeExporter(DbNativeExporter):
         return val
 
     def close(self):
+        self._flush()
         self.export_file.close()
+        self.export_file = None
         if sys.stdout.isatty():
             print("\nexported {} records{}".format(self.counter, ' ' * 10))
 
 
+class BatchWriter(DbSyncWriter):
+
+    def __init__(self, sobject: str, db: DbDriverMeta, cur, batch_size: int):
+        self.table_name = sobject.lower()
+        self.dbdriver = db
+        self.cur = cur
+        self.batch_size = batch_size
+        # records are kept as tuples of the values of these fields, in this order
+        self.names: Optional[List[str]] = None
+        self.rows: List[tuple] = list()
+        self.deletes: List = list()
+
+    @property
+    def pending(self) -> int:
+        return len(self.rows) + len(self.deletes)
+
+    def _set_names(self, keys):
+        if self.names is None:
+            existing_field_names = self.dbdriver.get_table_fields(self.table_name).keys()
+            self.names = [k for k in keys if k.lower() in existing_field_names]
+
+    def write(self, trec: Dict):
+        self._set_names(trec.keys())
+        self.rows.append(tuple(trec.get(k) for k in self.names))
+
+    def write_columns(self, columns: Dict[str, List]):
+        self._set_names(columns.keys())
+        self.rows.extend(zip(*[columns[k] for k in self.names]))
+
+    def delete(self, key: str):
+        self.deletes.append(key)
+
+    def flush(self) -> (int, int, int, int):
+        unchanged = 0
+        inserted, updated = 0, 0
+        if len(self.rows) > 0:
+            inserted, updated = self.dbdriver.upsert_rows(self.cur, self.table_name, self.names, self.rows)
+            id_index = self.names.index('Id')
+            unchanged = len(set(row[id_index] for row in self.rows)) - inserted - updated
+        deleted = self.dbdriver.delete_batch(self.cur, self.table_name, self.deletes)
+        self.rows = list()
+        self.deletes = list()
+        return inserted, updated, deleted, unchanged
+
+    def close(self):
+        pass
+
+
+class StagedWriter(DbSyncWriter):
+    """
+    Streams changes with COPY into a temp (unlogged) staging table shaped like the target, then applies
+    each window to the target with one set-based delete and one set-based upsert.
+    """
+
+    def __init__(self, sobject: str, db: DbDriverMeta, filemgr: FileManager, cur, batch_size: int):
+        self.table_name = sobject.lower()
+        self.stage_name = f'gf_stage_{self.table_name}'
+        self.dbdriver = db
+        self.cur = cur
+        self.batch_size = batch_size
+        self.rows: Dict[str, bytes] = dict()
+        self.deleted_keys = set()
+
+        fieldlist: [ColumnMap] = filemgr.get_sobject_map(self.table_name)
+        self.fieldmap = dict((f.db_field.lower(), f) for f in fieldlist)
+        self.tablefields: List = sorted(db.get_table_fields(self.table_name).values(),
+                                        key=operator.itemgetter('ordinal_position'))
+        self.columns = [tf['column_name'] for tf in self.tablefields]
+        self.id_index = self.columns.index('id')
+
+        cur.execute(f'drop table if exists pg_temp.{self.stage_name}')
+        cur.execute(f'create temp table {self.stage_name} ' +
+                    f'(like {db.fq_table(self.table_name)} including defaults)')
+        cur.execute(f'alter table {self.stage_name} add column gf_deleted boolean not null default false')
+
+    @property
+    def pending(self) -> int:
+        return len(self.rows)
+
+    def write(self, trec: Dict):
+        # keyed by Id so only the latest version of a record in the window is applied
+        line = self.dbdriver.format_for_export(trec, self.tablefields, self.fieldmap)
+        self.rows[trec['Id']] = line[:-1] + b'\tf\n'
+        self.deleted_keys.discard(trec['Id'])
+
+    def write_columns(self, columns: Dict[str, List]):
+        # format column by column, then put the rows together
+        count = len(next(iter(columns.values()), []))
+        parts = list()
+        for tf in self.tablefields:
+            n = tf['column_name']
+            f = self.fieldmap.get(n)
+            soqlf = f.sobject_field if f is not None else n
+            values = columns.get(soqlf)
+            parts.append(Driver.format_column(values) if values is not None else ['\\N'] * count)
+        keys = columns['Id']
+        for key, row in zip(keys, zip(*parts)):
+            self.rows[key] = bytes('\t'.join(row) + '\tf\n', 'utf-8')
+            self.deleted_keys.discard(key)
+
+    def delete(self, key: str):
+        parts = ['\\N'] * len(self.columns)
+        parts[self.id_index] = key
+        self.rows[key] = bytes('\t'.join(parts) + '\tt\n', 'utf-8')
+        self.deleted_keys.add(key)
+
+    def flush(self) -> (int, int, int, int):
+        if len(self.rows) == 0:
+            return 0, 0, 0, 0
+        cur = self.cur
+        candidates = len(self.rows) - len(self.deleted_keys)
+        target = self.dbdriver.fq_table(self.table_name)
+        colnames = ','.join(self.columns)
+
+        cur.copy_expert(f'copy {self.stage_name} ({colnames},gf_deleted) from stdin',
+                        io.BytesIO(b''.join(self.rows.values())))
+        self.rows = dict()
+        self.deleted_keys = set()
+
+        cur.execute(f'delete from {target} t using {self.stage_name} s where s.gf_deleted and t.id = s.id')
+        deleted = cur.rowcount
+
+        cur.execute(f'with changes as (insert into {target} as t ({colnames}) ' +
+                    f'select {colnames} from {self.stage_name} where not gf_deleted ' +
+                    Driver.on_conflict_clause(self.columns) + ' returning (xmax = 0) as inserted) ' +
+                    'select count(*) filter (where inserted), count(*) from changes')
+        inserted, total = cur.fetchone()
+
+        cur.execute(f'truncate {self.stage_name}')
+        return inserted, total - inserted, deleted, candidates - total
+
+    def close(self):
+        self.cur.execute(f'drop table if exists pg_temp.{self.stage_name}')
+
+
 class Driver(DbDriverMeta):
 
     def __init__(self):
@@ -149,6 +333,15 @@ class Driver(DbDriverMeta):
             self.log.fatal(ex)
             raise ex
 
+    def reconnect(self):
+        if self.db is not None and not self.db.closed:
+            try:
+                self.db.rollback()
+                return
+            except psycopg2.Error as ex:
+                self.log.warning(f'Database connection lost ({ex}), connecting again')
+        self.connect(self.dbenv)
+
     def exec_ddl(self, ddl: str):
         cur = self.db.cursor()
         cur.execute(ddl)
@@ -193,6 +386,26 @@ class Driver(DbDriverMeta):
                   '  sync_end   timestamp not null default now(), ' + \
                   '  sync_since timestamp not null)'
             self.exec_ddl(ddl)
+        if not self.column_exists('gf_mdata_sync_stats', 'noops'):
+            self.exec_ddl(f'alter table {self.schema_name}.gf_mdata_sync_stats ' +
+                          'add column noops numeric(8) not null default 0')
+        if not self.table_exists('gf_mdata_sync_checkpoint'):
+            ddl = f'create table {self.schema_name}.gf_mdata_sync_checkpoint (' + \
+                  '  table_name  text not null, ' + \
+                  '  scope       text not null, ' + \
+                  '  jobid       integer, ' + \
+                  '  watermark   timestamp, ' + \
+                  '  last_id     text, ' + \
+                  '  locator     text, ' + \
+                  '  bulk_job_id text, ' + \
+                  '  records     numeric(12) not null default 0, ' + \
+                  '  full_sync   boolean not null default false, ' + \
+                  '  updated     timestamp not null default now(), ' + \
+                  '  primary key (table_name, scope))'
+            self.exec_ddl(ddl)
+        if not self.column_exists('gf_mdata_sync_checkpoint', 'full_sync'):
+            self.exec_ddl(f'alter table {self.schema_name}.gf_mdata_sync_checkpoint ' +
+                          'add column full_sync boolean not null default false')
         if not self.table_exists('gf_mdata_schema_chg'):
             ddl = f'create table {self.schema_name}.gf_mdata_schema_chg (' + \
                   '  id         serial primary key, ' + \
@@ -225,18 +438,82 @@ class Driver(DbDriverMeta):
         cur.execute(f'update {self.schema_name}.gf_mdata_sync_jobs set date_finish=%s where id=%s',
                     (datetime.datetime.now(), jobid))
         cur.close()
+        self.db.commit()
 
-    def insert_sync_stats(self, jobid, table_name, sync_start, sync_end, sync_since, inserts, updates, deletes, api_calls):
+    def insert_sync_stats(self, jobid, table_name, sync_start, sync_end, sync_since, inserts, updates, deletes, api_calls,
+                          noops=0):
         cur = self.cursor
         if sync_since is None:
             sync_since = datetime.datetime(1970, 1, 1, 0, 0, 0)
         dml = f'insert into {self.schema_name}.gf_mdata_sync_stats ' + \
               '(jobid, table_name, inserts, updates, deletes, sync_start, ' + \
-              'sync_end, sync_since, api_calls) values (%s,%s,%s,%s,%s,%s,%s,%s,%s)'
+              'sync_end, sync_since, api_calls, noops) values (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)'
 
-        cur.execute(dml, (jobid, table_name, inserts, updates, deletes, sync_start, sync_end, sync_since, api_calls))
+        cur.execute(dml, (jobid, table_name, inserts, updates, deletes, sync_start, sync_end, sync_since, api_calls,
+                          noops))
         self.db.commit()
 
+    def lock_table(self, table_name: str, shared: bool = False) -> bool:
+        cur = self.cursor
+        cur.execute(f'select pg_try_advisory_lock{"_shared" if shared else ""}(hashtext(%s))',
+                    (self.fq_table(table_name),))
+        locked, = cur.fetchone()
+        cur.close()
+        return locked
+
+    def unlock_table(self, table_name: str, shared: bool = False):
+        cur = self.cursor
+        cur.execute(f'select pg_advisory_unlock{"_shared" if shared else ""}(hashtext(%s))',
+                    (self.fq_table(table_name),))
+        cur.close()
+
+    def get_checkpoint(self, table_name: str, scope: str) -> Optional[SyncCheckpoint]:
+        cur = self.new_map_cursor
+        cur.execute(f'select * from {self.schema_name}.gf_mdata_sync_checkpoint where table_name=%s and scope=%s',
+                    (table_name, scope))
+        row = cur.fetchone()
+        cur.close()
+        if row is None:
+            return None
+        return SyncCheckpoint(dict(row))
+
+    def list_checkpoints(self, table_name: str, scope_prefix: str) -> List[SyncCheckpoint]:
+        cur = self.new_map_cursor
+        cur.execute(f'select * from {self.schema_name}.gf_mdata_sync_checkpoint where table_name=%s and ' +
+                    'scope like %s order by scope', (table_name, scope_prefix + '%'))
+        checkpoints = [SyncCheckpoint(dict(row)) for row in cur.fetchall()]
+        cur.close()
+        return checkpoints
+
+    def save_checkpoint(self, cur, checkpoint: SyncCheckpoint):
+        dml = f'insert into {self.schema_name}.gf_mdata_sync_checkpoint as c ' + \
+              '(table_name, scope, jobid, watermark, last_id, locator, bulk_job_id, records, full_sync, updated) ' + \
+              'values (%s,%s,%s,%s,%s,%s,%s,%s,%s,now()) on conflict (table_name, scope) do update set ' + \
+              'jobid=EXCLUDED.jobid, watermark=EXCLUDED.watermark, last_id=EXCLUDED.last_id, ' + \
+              'locator=EXCLUDED.locator, bulk_job_id=EXCLUDED.bulk_job_id, records=EXCLUDED.records, ' + \
+              'full_sync=EXCLUDED.full_sync, updated=now()'
+        cur.execute(dml, (checkpoint.table_name, checkpoint.scope, checkpoint.jobid, checkpoint.watermark,
+                          checkpoint.last_id, checkpoint.locator, checkpoint.bulk_job_id, checkpoint.records,
+                          checkpoint.full_sync))
+
+    def clear_checkpoint(self, cur, table_name: str, scope: str):
+        cur.execute(f'delete from {self.schema_name}.gf_mdata_sync_checkpoint where table_name=%s and scope=%s',
+                    (table_name, scope))
+
+    def get_sync_history(self, runs: int = 10) -> Dict[str, Tuple[float, float]]:
+        cur = self.cursor
+        # a table synced in several ranges has one stats row per range, so total them up by job first
+        sql = 'select table_name, avg(seconds), avg(records) from ' + \
+              '(select table_name, extract(epoch from max(sync_end) - min(sync_start)) as seconds, ' + \
+              'sum(inserts + updates + deletes + noops) as records, ' + \
+              'row_number() over (partition by table_name order by min(sync_start) desc) as run ' + \
+              f' from {self.schema_name}.gf_mdata_sync_stats group by table_name, jobid) s ' + \
+              'where run <= %s group by table_name'
+        cur.execute(sql, (runs,))
+        history = {name: (float(seconds), float(rows)) for name, seconds, rows in cur.fetchall()}
+        cur.close()
+        return history
+
     def clean_house(self, date_constraint: datetime):
         cur = self.cursor
         dml = f'delete from {self.schema_name}.gf_mdata_sync_jobs where date_start < %s'
@@ -251,6 +528,12 @@ class Driver(DbDriverMeta):
         self.db.commit()
         cur.close()
 
+    def enable_row_hash(self, table_name: str):
+        if ROW_HASH_COLUMN in self.get_table_fields(table_name):
+            return
+        self.exec_ddl(f'alter table {self.fq_table(table_name)} add column if not exists {ROW_HASH_COLUMN} char(32)')
+        self.clear_table_cache()
+
     def import_native(self, tablename):
         tablename = tablename.lower()
 
@@ -260,6 +543,15 @@ class Driver(DbDriverMeta):
                 cur.copy_from(infile, tablename)
             self.db.commit()
 
+    def import_csv(self, table_name: str, columns: [str], source) -> int:
+        colnames = ','.join(columns)
+        with self.cursor as cur:
+            cur.copy_expert(f'copy {self.fq_table(table_name.lower())} ({colnames}) from stdin with (format csv)',
+                            source, size=64 * 1024)
+            count = cur.rowcount
+        self.db.commit()
+        return count
+
     def export_native(self, table_name, output_path):
         table_name = table_name.lower()
         with self.cursor as cur:
@@ -277,6 +569,20 @@ class Driver(DbDriverMeta):
             self.log.error(f'Deleting record {key} from {table_name}')
             return 0
 
+    def delete_batch(self, cur, table_name: str, keys: [str]) -> int:
+        """
+        Delete the given record ids in chunks of array deletes.
+
+        :return: number of rows actually deleted
+        """
+        table_name = self.fq_table(table_name)
+        deleted = 0
+        for i in range(0, len(keys), DELETE_CHUNK_SIZE):
+            # cast to the column type so the primary key index is used
+            cur.execute(f'delete from {table_name} where id = any(%s::bpchar[])', [keys[i:i + DELETE_CHUNK_SIZE]])
+            deleted += cur.rowcount
+        return deleted
+
     def upsert(self, cur, table_name, trec: dict, journal=None):
         assert ('Id' in trec)
 
@@ -348,6 +654,67 @@ class Driver(DbDriverMeta):
             updated = True
         return inserted, updated
 
+    def upsert_batch(self, cur, table_name: str, trecs: [dict], journal=None) -> (int, int):
+        """
+        Insert or update a page of transformed records using set-based statements.
+
+        Rows whose values are unchanged are left alone (the overlapping SystemModStamp case) and are
+        counted as neither inserted nor updated.
+
+        :return: tuple of (inserted, updated) counts
+        """
+        if len(trecs) == 0:
+            return 0, 0
+        existing_field_names = self.get_table_fields(table_name).keys()
+        namelist = [k for k in trecs[0].keys() if k.lower() in existing_field_names]
+        return self.upsert_rows(cur, table_name, namelist, [tuple(trec.get(k) for k in namelist) for trec in trecs],
+                                journal)
+
+    def upsert_rows(self, cur, table_name: str, names: [str], rows: [tuple], journal=None) -> (int, int):
+        """
+        upsert_batch() for records already made into tuples of the values of the named fields.
+        """
+        if len(rows) == 0:
+            return 0, 0
+        assert ('Id' in names)
+
+        #
+        # A record may show up more than once in a page if it changed while we were paging. ON CONFLICT
+        # cannot touch the same row twice in one statement, so keep only the latest copy.
+        #
+        id_index = names.index('Id')
+        data = list({row[id_index]: row for row in rows}.values())
+        colnames = [k.lower() for k in names]
+
+        sql = 'insert into {0} as t ({1}) values %s '.format(self.fq_table(table_name), ','.join(colnames))
+        sql += Driver.on_conflict_clause(colnames)
+        # xmax is only zero for a freshly inserted row version
+        sql += ' returning (xmax = 0)'
+
+        if journal:
+            journal.write(bytes('b:{} --> {}\n'.format(sql, json.dumps(data, default=tools.json_serial)), 'utf-8'))
+        results = psycopg2.extras.execute_values(cur, sql, data, page_size=len(data), fetch=True)
+        inserted = sum(1 for r in results if r[0])
+        return inserted, len(results) - inserted
+
+    @staticmethod
+    def on_conflict_clause(colnames: [str]) -> str:
+        """
+        Upsert on the primary key, only rewriting rows where at least one value actually changed.
+        The inserted values are referenced as EXCLUDED and the existing row must be aliased as t.
+        When the row hash column is present it alone decides whether the row changed.
+        """
+        setcols = [c for c in colnames if c != 'id']
+        if len(setcols) == 0:
+            return 'on conflict (id) do nothing'
+        if ROW_HASH_COLUMN in setcols:
+            return 'on conflict (id) do update set {0} where t.{1} is distinct from EXCLUDED.{1}'.format(
+                ','.join(f'{c}=EXCLUDED.{c}' for c in setcols), ROW_HASH_COLUMN)
+        return 'on conflict (id) do update set {0} where ({1}) is distinct from ({2})'.format(
+            ','.join(f'{c}=EXCLUDED.{c}' for c in setcols),
+            ','.join(f't.{c}' for c in setcols),
+            ','.join(f'EXCLUDED.{c}' for c in setcols))
+
     def commit(self):
         self.db.commit()
 
@@ -371,6 +738,9 @@ class Driver(DbDriverMeta):
                                               'ordinal_position': c['ordinal_position']}
         return table_fields
 
+    def clear_table_cache(self):
+        self.get_table_fields.cache_clear()
+
     def dump_ids(self, table_name: str, output_filename: str):
         cur = self.cursor
         sql = f'select id from {self.schema_name}.{table_name} order by id'
@@ -383,7 +753,7 @@ class Driver(DbDriverMeta):
     def record_count(self, table_name: str) -> int:
         table_cursor = self.db.cursor()
         table_cursor.execute('SELECT count(*) FROM {}.{}'.format(self.schema_name, table_name))
-        records = table_cursor.fetchone()
+        records, = table_cursor.fetchone()
         table_cursor.close()
         return records
 
@@ -406,6 +776,16 @@ class Driver(DbDriverMeta):
         cnt, = val
         return cnt > 0
 
+    def column_exists(self, table_name: str, column_name: str) -> bool:
+        # checked first because adding a column, even one that exists, waits for every other use of the table
+        col_cursor = self.db.cursor()
+        col_cursor.execute(
+            "select count(*) from information_schema.columns where table_name = %s and table_schema=%s and "
+            "column_name = %s", (table_name, self.schema_name, column_name))
+        cnt, = col_cursor.fetchone()
+        col_cursor.close()
+        return cnt > 0
+
     def get_db_columns(self, table_name: str) -> List:
         col_cursor = self.new_map_cursor
         col_cursor.execute(
@@ -493,6 +873,7 @@ class Driver(DbDriverMeta):
 
         self.db.commit()
         cur.close()
+        self.clear_table_cache()
         return newcols
 
     def alter_table_drop_columns(self, drop_field_names: [str], sobject_name: str):
@@ -509,6 +890,7 @@ class Driver(DbDriverMeta):
 
         self.db.commit()
         cur.close()
+        self.clear_table_cache()
 
     def maintain_indexes(self, sobject_name, field_defs: SObjectFields):
         ddl_template = "CREATE INDEX IF NOT EXISTS {}_{} ON {} ({})"
@@ -550,35 +932,95 @@ class Driver(DbDriverMeta):
         return stamp
 
     def make_transformer(self, sobject_name, table_name, fieldlist: [ColumnMap]):
-        parser = 'from gurglefish.transformutils import id, bl, db, dt, st, ts, tm, inte\n\n'
+        parser = 'from gurglefish.transformutils import id, bl, db, dt, st, ts, tm, inte, bulk_dt, bulk_ts, ' \
+                 'csv_bl, csv_db, csv_inte, id_col, db_col, dt_col, st_col, ts_col, tm_col, copy_number, ' \
+                 'copy_text, row_hash\n\n'
+        parser += "N = '\\\\N'\n\n\n"
         parser += 'def parse(rec):\n' + \
                   '  result = dict()\n\n'
         #                  '  def push(name, value):\n' + \
         #                  '    result[name] = value\n\n'
 
+        #
+        # bulk api (1.0) results have dates and datetimes as millis since the epoch, and booleans and numbers
+        # already typed, so they get their own parser rather than being made into strings to parse again
+        #
+        bulk_parser = 'def parse_bulk(rec):\n' + \
+                      '  result = dict()\n\n'
+
+        #
+        # bulk api 2.0 CSV results are all strings, booleans and numbers are typed as parse() gets them
+        #
+        csv_parser = 'def parse_csv(rec):\n' + \
+                     '  result = dict()\n\n'
+
+        #
+        # a whole page of records at a time, one list of values per column, for the sync writers
+        #
+        page_parser = 'def parse_page(records):\n' + \
+                      '  return {\n'
+
+        #
+        # a record straight to a line of an export file (COPY text format), without building the dict of
+        # transformed values first. ISO dates and times are written the way they were received, as parsing
+        # them and formatting them again gives back the same text.
+        #
+        copy_writer = 'def copy_line(rec, buf):\n' + \
+                      '  get = rec.get\n'
+        copied = []
+
+        hashed = []
         for field in fieldlist:
             fieldtype = field.field_type
             fieldname = field.sobject_field
             fieldlen = field.fieldlen
             dbfield = field.db_field
             p_parser = ''
+            b_parser = None
+            v_parser = None
+            column = f'[rec.get("{fieldname}") for rec in records]'
+            c_parser = None
+            w_text = None
             if fieldtype in ('picklist', 'multipicklist', 'string', 'textarea', 'email', 'phone',
                              'url', 'encryptedstring', 'combobox'):
                 p_parser = f'result["{dbfield}"] = st(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = f'st_col({column}, fieldlen={fieldlen})'
+                w_text = f"v[0:{fieldlen}] if '\\\\' not in v and v.isprintable() else copy_text(v[0:{fieldlen}])"
             elif fieldtype == 'datetime':
                 p_parser = f'result["{dbfield}"] = ts(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                b_parser = f'result["{dbfield}"] = bulk_ts(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = f'ts_col({column}, fieldlen={fieldlen})'
+                w_text = 'v[0:19]'
             elif fieldtype == 'date':
                 p_parser = f'result["{dbfield}"] = dt(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                b_parser = f'result["{dbfield}"] = bulk_dt(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = f'dt_col({column}, fieldlen={fieldlen})'
+                w_text = 'v'
             elif fieldtype == 'time':
                 p_parser = f'result["{dbfield}"] = tm(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = f'tm_col({column}, fieldlen={fieldlen})'
+                w_text = 'v[0:8]'
             elif fieldtype in ('id', 'reference'):
                 p_parser = f'result["{dbfield}"] = id(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = f'id_col({column}, fieldlen={fieldlen})'
+                w_text = 'v[0:15]'
             elif fieldtype == 'boolean':
                 p_parser = f'result["{dbfield}"] = bl(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                b_parser = f'result["{dbfield}"] = rec.get("{fieldname}")\n'
+                v_parser = f'result["{dbfield}"] = csv_bl(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = column
+                w_text = "'True' if v is True else 'False' if v is False else copy_text(str(v))"
             elif fieldtype in ('double', 'currency', 'percent'):
                 p_parser = f'result["{dbfield}"] = db(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                v_parser = f'result["{dbfield}"] = csv_db(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = f'db_col({column}, fieldlen={fieldlen})'
+                w_text = f'copy_number(v, {fieldlen})'
             elif fieldtype == 'int':
                 p_parser = f'result["{dbfield}"] = inte(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                b_parser = f'result["{dbfield}"] = rec.get("{fieldname}")\n'
+                v_parser = f'result["{dbfield}"] = csv_inte(rec, "{fieldname}", fieldlen={fieldlen})\n'
+                c_parser = column
+                w_text = 'str(v)'
             elif fieldtype in ('base64', 'anyType'):  # not implemented yet <<<<<<
                 return None
             elif fieldtype == 'address':
@@ -586,8 +1028,34 @@ class Driver(DbDriverMeta):
                 #                                                                         field['subfield'], fieldlen)
                 pass
 
+            if len(p_parser) > 0:
+                hashed.append(dbfield)
+                page_parser += f'    "{dbfield}": {c_parser},\n'
+                copy_writer += f'  v = get("{fieldname}")\n' + \
+                               f'  c{len(copied)} = N if v is None else {w_text}\n'
+                copied.append(dbfield)
             parser += '  ' + p_parser
-        parser += '  return result'
+            bulk_parser += '  ' + (b_parser if b_parser is not None else p_parser)
+            csv_parser += '  ' + (v_parser if v_parser is not None else p_parser)
+        parser += '  return result\n\n\n'
+        bulk_parser += '  return result\n\n\n'
+        csv_parser += '  return result\n\n\n'
+        page_parser += '  }\n\n\n'
+        copy_writer += "  buf += ('\\t'.join([" + ', '.join(f'c{i}' for i in range(len(copied))) + \
+                       "]) + '\\n').encode('utf-8')\n\n\n"
+        parser += bulk_parser + csv_parser + page_parser
+
+        # table columns copy_line() writes, in order
+        parser += 'COPY_COLUMNS = (' + ''.join(f'"{name.lower()}", ' for name in copied) + ')\n\n\n'
+        parser += copy_writer
+
+        # hash of the transformed values, in a fixed column order, used to detect unchanged records
+        parser += 'def fingerprint(result):\n' + \
+                  '  return row_hash((' + ', '.join(f'result["{name}"]' for name in hashed) + ',))\n\n\n'
+        # the same for a page of columns from parse_page()
+        parser += 'def fingerprint_page(columns):\n' + \
+                  '  return [row_hash(values) for values in zip(' + \
+                  ', '.join(f'columns["{name}"]' for name in hashed) + ')]\n'
         return parser
 
     @lru_cache(maxsize=10, typed=False)
@@ -603,12 +1071,32 @@ class Driver(DbDriverMeta):
             val = val.replace('\t', '\\t')
         return val
 
+    @staticmethod
+    def format_column(values: List) -> List[str]:
+        """
+        COPY text of each value in a column, as format_for_export() writes them.
+        """
+        parts = []
+        for val in values:
+            if val is None:
+                parts.append('\\N')
+            elif isinstance(val, bool):
+                parts.append('True' if val else 'False')
+            elif isinstance(val, datetime.datetime):
+                parts.append(val.isoformat())
+            elif isinstance(val, str):
+                parts.append(Driver._escape(val))
+            else:
+                parts.append(str(val))
+        return parts
+
     def format_for_export(self, trec: Dict, tablefields: [Dict], fieldmap: Dict[str, ColumnMap]):
         parts = []
         for tf in tablefields:
             n = tf['column_name']
-            f = fieldmap[n]
-            soqlf = f.sobject_field
+            f = fieldmap.get(n)
+            # columns maintained by gurglefish are not in the map and use the column name as-is
+            soqlf = f.sobject_field if f is not None else n
             if soqlf in trec:
                 val = trec[soqlf]
                 if val is None:
@@ -629,3 +1117,8 @@ class Driver(DbDriverMeta):
     def create_exporter(self, sobject_name: str, ctx: Context, just_sample=False, timestamp=None) -> DbNativeExporter:
         exporter = NativeExporter(sobject_name, self, ctx.filemgr, just_sample, timestamp)
         return exporter
+
+    def create_sync_writer(self, cur, sobject_name: str, ctx: Context, batch_size: int, staged=False) -> DbSyncWriter:
+        if staged:
+            return StagedWriter(sobject_name, self, ctx.filemgr, cur, batch_size)
+        return BatchWriter(sobject_name, self, cur, batch_size)
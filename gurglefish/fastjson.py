@@ -0,0 +1,188 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+import re
+from typing import Callable, Dict, Iterable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__author__ = 'Marshall L Smith Jr'
+
+#
+# JSON decoders in order of preference. They are given the raw UTF-8 bytes of a response (bytes or
+# bytearray) so the body is never decoded to a str first.
+#
+DECODERS: Dict[str, Callable] = dict()
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+DECODERS['json'] = json.loads
+
+decoder_name = next(iter(DECODERS))
+loads: Callable[[Union[bytes, bytearray, str]], object] = DECODERS[decoder_name]
+
+
+def register(name: str, decoder: Callable):
+    """
+    Make another decoder available to use().
+    """
+    DECODERS[name] = decoder
+
+
+def use(name: str):
+    """
+    Select the JSON decoder by name - orjson (the default when installed), json or one registered.
+    """
+    global loads, decoder_name
+    if name not in DECODERS:
+        logging.getLogger('main').warning(f'JSON decoder {name} is not installed, using {decoder_name}')
+        return
+    decoder_name = name
+    loads = DECODERS[name]
+
+
+#
+# Skips everything up to the next bracket, stepping over short strings so brackets inside them are
+# ignored. Stops at the opening quote of a long string, or one that isn't complete yet - the end of
+# those is found with _string_end(), which is much faster on long strings than a regex.
+#
+_SKIP = re.compile(rb'[^"{}\[\]]*(?:"[^"\\]{0,1024}(?:\\.[^"\\]{0,1024})*"[^"{}\[\]]*)*', re.DOTALL)
+# key of the array opened at the end of a run of top-level object content
+_KEY = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*:\s*$', re.DOTALL)
+
+_OPEN = (ord('{'), ord('['))
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+
+
+def iter_items(chunks: Iterable[bytes], key: Optional[str] = None, envelope: Optional[Dict] = None):
+    """
+    Incrementally parse a JSON document read in chunks, yielding the elements of one array as soon as
+    each is complete. Only one element is held in memory at a time, and the layout of the document
+    (line breaks, indenting) doesn't matter.
+
+    :param chunks: the document in pieces of any size, such as Response.iter_content()
+    :param key: yield the elements of the array under this key of the top-level object, or of the
+                top-level array if None. The elements must be objects or arrays.
+    :param envelope: if given it is updated with the rest of the top-level object once parsing is done,
+                     such as totalSize and nextRecordsUrl of a query result
+    """
+    target = key.encode('utf-8') if key is not None else None
+    buf = bytearray()
+    pos = 0
+    depth = 0
+    # depth of the elements of the array being streamed, None outside it
+    item_depth = None
+    item_start = None
+    found = False
+    # top-level content outside the array, and where the part of it not saved yet starts in buf
+    outside = bytearray()
+    outside_from = 0
+    # where to look for the end of a string at pos that was cut off by the end of the last chunk
+    string_scan = None
+
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            if string_scan is not None:
+                # carry on from where the last chunk ended rather than scanning a long string again
+                end = _string_end(buf, string_scan)
+                if end < 0:
+                    string_scan = len(buf)
+                    break
+                string_scan = None
+                pos = end
+            p = _SKIP.match(buf, pos).end()
+            if p == len(buf):
+                pos = p
+                break
+            if buf[p] == _QUOTE:
+                # skip over the string, unless it is cut off by the end of the chunk
+                pos = p
+                string_scan = p + 1
+                continue
+            c = buf[p]
+            if c in _OPEN:
+                if item_depth is not None:
+                    if depth == item_depth and item_start is None:
+                        item_start = p
+                elif not found and c == _OPEN[1] and (depth == 0 if target is None else depth == 1):
+                    outside += buf[outside_from:p]
+                    outside_from = p
+                    if target is None or _is_key(outside, target):
+                        found = True
+                        item_depth = depth + 1
+                        outside += b'['
+                        outside_from = None
+                depth += 1
+            else:
+                depth -= 1
+                if item_depth is not None:
+                    if depth == item_depth and item_start is not None:
+                        yield loads(buf[item_start:p + 1])
+                        item_start = None
+                    elif depth < item_depth:
+                        item_depth = None
+                        outside_from = p
+            pos = p + 1
+
+        # drop what has been dealt with
+        if outside_from is not None:
+            outside += buf[outside_from:pos]
+            outside_from = pos
+        keep = item_start if item_start is not None else pos
+        if keep > 0:
+            del buf[:keep]
+            pos -= keep
+            if item_start is not None:
+                item_start = 0
+            if outside_from is not None:
+                outside_from -= keep
+            if string_scan is not None:
+                string_scan -= keep
+
+    if depth != 0 or item_start is not None or string_scan is not None:
+        raise ValueError('incomplete JSON document')
+    if outside_from is not None:
+        outside += buf[outside_from:]
+    if envelope is not None and target is not None:
+        envelope.update(loads(outside))
+
+
+def _is_key(outside: bytearray, target: bytes) -> bool:
+    match = _KEY.search(outside)
+    return match is not None and match.group(1) == target
+
+
+def _string_end(buf: bytearray, start: int) -> int:
+    """
+    Position just past the closing quote of the string that contains start, or -1 if it isn't in buf yet.
+    """
+    while True:
+        quote = buf.find(b'"', start)
+        if quote < 0:
+            return -1
+        # the quote is escaped if an odd number of backslashes come before it
+        before = quote - 1
+        while buf[before] == _BACKSLASH:
+            before -= 1
+        if (quote - 1 - before) % 2 == 0:
+            return quote + 1
+        start = quote + 1
@@ -0,0 +1,120 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import re
+import time
+from multiprocessing import Value
+from typing import Dict, Optional, Tuple
+
+__author__ = 'Marshall L Smith Jr'
+
+_USAGE = re.compile(r'api-usage=(\d+)/(\d+)')
+
+# longest pause between requests when throttling, reached just below the pause threshold
+MAX_THROTTLE_DELAY = 5.0
+
+
+class ApiGovernor(object):
+    """
+    Keeps API usage under the org's daily request allocation, shared by all worker processes.
+
+    Usage is taken from the Sforce-Limit-Info header of every response, and from the /limits resource
+    every poll_interval seconds. Above throttle_pct percent of the allocation requests are slowed down and
+    tables given a negative priority are deferred. Above pause_pct percent requests wait, polling
+    /limits, until usage drops back below it.
+    """
+
+    def __init__(self, throttle_pct: int = 80, pause_pct: int = 95, poll_interval: int = 300):
+        self.throttle = throttle_pct / 100
+        self.pause = pause_pct / 100
+        self.poll_interval = poll_interval
+        self.log = logging.getLogger('governor')
+        # shared by forked workers
+        self._used = Value('q', 0)
+        self._max = Value('q', 0)
+        self._polled = Value('d', 0.0)
+        self._paused = Value('b', False)
+
+    @property
+    def used(self) -> int:
+        return self._used.value
+
+    @property
+    def max(self) -> int:
+        return self._max.value
+
+    @property
+    def usage(self) -> float:
+        """
+        Fraction of the daily allocation used, 0 if not known yet.
+        """
+        if self._max.value == 0:
+            return 0.0
+        return self._used.value / self._max.value
+
+    def observe_header(self, value: Optional[str]):
+        """
+        Record usage from a Sforce-Limit-Info header, such as "api-usage=25/15000".
+        """
+        if value is None:
+            return
+        match = _USAGE.search(value)
+        if match is not None:
+            self._update(int(match.group(1)), int(match.group(2)))
+
+    def observe_limits(self, limits: Dict):
+        """
+        Record usage from the response of the /limits resource.
+        """
+        daily = limits.get('DailyApiRequests', None)
+        if daily is not None:
+            self._update(daily['Max'] - daily['Remaining'], daily['Max'])
+        self._polled.value = time.time()
+
+    def _update(self, used: int, maximum: int):
+        with self._used.get_lock():
+            self._used.value = used
+            self._max.value = maximum
+
+    def needs_poll(self) -> bool:
+        return time.time() - self._polled.value >= self.poll_interval
+
+    def next_wait(self) -> Tuple[float, bool]:
+        """
+        How long to hold the next request.
+
+        :return: seconds to wait, and whether requests are paused (wait, poll /limits, then ask again)
+        """
+        usage = self.usage
+        if usage >= self.pause:
+            if not self._paused.value:
+                self._paused.value = True
+                self.log.warning(f'API usage at {self.used} of {self.max} - pausing until it drops below '
+                                 f'{self.pause:.0%}')
+            return float(self.poll_interval), True
+        if self._paused.value:
+            self._paused.value = False
+            self.log.info(f'API usage at {self.used} of {self.max} - resuming')
+        if usage >= self.throttle:
+            return MAX_THROTTLE_DELAY * (usage - self.throttle) / (self.pause - self.throttle), False
+        return 0.0, False
+
+    def should_defer(self, priority: int) -> bool:
+        """
+        True if a table of this priority should wait for a later run to save API calls.
+        """
+        return priority < 0 and self.usage >= self.throttle
@@ -0,0 +1,138 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+from typing import Dict, Optional
+
+from gurglefish.transformutils import py_timestamp
+
+SCOPE_SYNC = 'sync'
+SCOPE_EXPORT = 'export'
+SCOPE_CURSOR = 'cursor'
+SCOPE_RANGE = 'range'
+
+
+class SyncCheckpoint(object):
+    """
+    Position of an interrupted table sync or export, saved in the same transaction as the data it covers.
+    """
+
+    def __init__(self, adict: Dict):
+        self.item = adict
+
+    @staticmethod
+    def create(table_name: str, scope: str, jobid=None, full_sync: bool = False):
+        return SyncCheckpoint({'table_name': table_name, 'scope': scope, 'jobid': jobid, 'watermark': None,
+                               'last_id': None, 'locator': None, 'bulk_job_id': None, 'records': 0,
+                               'full_sync': full_sync})
+
+    @property
+    def dict(self):
+        return self.item
+
+    @property
+    def table_name(self) -> str:
+        return self.item['table_name']
+
+    @property
+    def scope(self) -> str:
+        return self.item['scope']
+
+    @property
+    def jobid(self):
+        return self.item.get('jobid', None)
+
+    @jobid.setter
+    def jobid(self, val):
+        self.item['jobid'] = val
+
+    @property
+    def watermark(self) -> Optional[datetime.datetime]:
+        return self.item.get('watermark', None)
+
+    @property
+    def last_id(self) -> Optional[str]:
+        return self.item.get('last_id', None)
+
+    @property
+    def locator(self) -> Optional[str]:
+        return self.item.get('locator', None)
+
+    @property
+    def bulk_job_id(self) -> Optional[str]:
+        return self.item.get('bulk_job_id', None)
+
+    @bulk_job_id.setter
+    def bulk_job_id(self, val):
+        self.item['bulk_job_id'] = val
+
+    @property
+    def records(self) -> int:
+        return int(self.item.get('records', 0))
+
+    @records.setter
+    def records(self, val):
+        self.item['records'] = val
+
+    @property
+    def full_sync(self) -> bool:
+        """
+        True for a download of the whole table, which doesn't need deleted records and so is queried
+        without queryAll.
+        """
+        return bool(self.item.get('full_sync', False))
+
+    def advance(self, locator: Optional[str], last_stamp: Optional[str], last_id: Optional[str]):
+        """
+        Move the checkpoint to just after the last record of a page that has been applied.
+
+        :param locator: nextRecordsUrl following the page, if any
+        :param last_stamp: SystemModstamp of the last record in the page, as returned by Salesforce
+        :param last_id: Id of the last record in the page
+        """
+        self.item['locator'] = locator
+        if last_stamp is not None:
+            self.item['watermark'] = py_timestamp(last_stamp)
+            self.item['last_id'] = last_id
+
+
+class KeyRange(object):
+    """
+    SystemModStamp window of a table synced by several workers at once. Either end may be open.
+    """
+
+    def __init__(self, start: Optional[datetime.datetime], end: Optional[datetime.datetime]):
+        self.start = start
+        self.end = end
+
+    @property
+    def scope(self) -> str:
+        """
+        Checkpoint scope of the range. It records the bounds so an interrupted split sync can be picked
+        up again with the same ranges.
+        """
+        start = self.start.strftime('%Y-%m-%dT%H:%M:%S') if self.start is not None else ''
+        end = self.end.strftime('%Y-%m-%dT%H:%M:%S') if self.end is not None else ''
+        return f'{SCOPE_RANGE}|{start}|{end}'
+
+    @staticmethod
+    def from_scope(scope: str):
+        _, start, end = scope.split('|')
+        return KeyRange(py_timestamp(start) if start else None, py_timestamp(end) if end else None)
+
+    def __str__(self):
+        return f'[{self.start or "*"}, {self.end or "*"})'
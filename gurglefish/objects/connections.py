@@ -146,7 +146,27 @@ class ConnectionConfig(object):
 
     @property
     def threads(self) -> int:
-        return min(int(self.fields.get('threads', '1')), 4)
+        return max(int(self.fields.get('threads', '1')), 1)
+
+    @property
+    def api_throttle_pct(self) -> int:
+        return int(self.fields.get('api_throttle_pct', '80'))
+
+    @property
+    def api_pause_pct(self) -> int:
+        return int(self.fields.get('api_pause_pct', '95'))
+
+    @property
+    def api_retries(self) -> int:
+        return int(self.fields.get('api_retries', '5'))
+
+    @property
+    def json_decoder(self) -> Optional[str]:
+        return self.fields.get('json_decoder', None)
+
+    @property
+    def api_concurrency(self) -> int:
+        return max(int(self.fields.get('api_concurrency', '20')), 1)
 
 
 class Connections(object):
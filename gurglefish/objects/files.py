@@ -15,7 +15,23 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Dict
+from typing import Dict, Optional
+
+_SCHEDULE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_interval(schedule) -> Optional[int]:
+    """
+    Seconds in an interval such as 300, "90s", "15m", "1h" or "1d". None for "auto".
+    """
+    if schedule is None or schedule == 'auto':
+        return None
+    if isinstance(schedule, int):
+        return schedule
+    schedule = schedule.strip().lower()
+    if schedule[-1] in _SCHEDULE_UNITS:
+        return int(schedule[:-1]) * _SCHEDULE_UNITS[schedule[-1]]
+    return int(schedule)
 
 
 class LocalTableConfig(object):
@@ -55,6 +71,13 @@ class LocalTableConfig(object):
     def sync_schedule(self):
         return self.item.get('sync_schedule', 'auto')
 
+    @property
+    def sync_interval(self) -> Optional[int]:
+        """
+        Seconds between syncs in daemon mode, None for the "auto" schedule.
+        """
+        return parse_interval(self.sync_schedule)
+
     @property
     def package_name(self):
         return self.item.get('package', None)
@@ -62,3 +85,55 @@ class LocalTableConfig(object):
     @property
     def use_bulkapi(self) -> bool:
         return self.item.get('bulkapi', False)
+
+    @property
+    def bulkapi_version(self) -> int:
+        return int(self.item.get('bulkapi_version', 1))
+
+    @property
+    def bulkapi_max_records(self) -> int:
+        return int(self.item.get('bulkapi_max_records', 0))
+
+    @property
+    def bulkapi_download_threads(self) -> int:
+        return max(int(self.item.get('bulkapi_download_threads', 4)), 1)
+
+    @property
+    def pk_chunk_size(self) -> int:
+        return int(self.item.get('pk_chunk_size', 5000))
+
+    @property
+    def pk_chunk_threshold(self) -> int:
+        return int(self.item.get('pk_chunk_threshold', 200_000))
+
+    @property
+    def batch_size(self) -> int:
+        return int(self.item.get('batch_size', 2000))
+
+    @property
+    def staging_threshold(self) -> int:
+        return int(self.item.get('staging_threshold', 100_000))
+
+    @property
+    def row_fingerprint(self) -> bool:
+        return self.item.get('row_fingerprint', False)
+
+    @property
+    def priority(self) -> int:
+        return int(self.item.get('priority', 0))
+
+    @property
+    def weight(self) -> int:
+        return int(self.item.get('weight', 1))
+
+    @property
+    def split_threshold(self) -> int:
+        return int(self.item.get('split_threshold', 1_000_000))
+
+    @property
+    def keyset_paging(self) -> bool:
+        return self.item.get('keyset_paging', False)
+
+    @property
+    def keyset_chunk_size(self) -> int:
+        return int(self.item.get('keyset_chunk_size', 2000))
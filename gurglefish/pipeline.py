@@ -0,0 +1,172 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+__author__ = 'Marshall L Smith Jr'
+
+_END = object()
+
+
+class _Failure(object):
+    def __init__(self, ex: Exception):
+        self.ex = ex
+
+
+class StageTimer(object):
+
+    def __init__(self, name: str):
+        self.name = name
+        self.busy = 0.0
+        self.wait = 0.0
+        self.items = 0
+
+    def __str__(self):
+        return f'{self.name}: {self.items} items, busy {self.busy:.1f}s, waiting {self.wait:.1f}s'
+
+
+class _Stage(threading.Thread):
+
+    def __init__(self, pipeline, timer: StageTimer, inbound: Optional[queue.Queue], outbound: queue.Queue,
+                 source: Iterable = None, func: Callable = None):
+        super().__init__(daemon=True, name=f'{pipeline.name}-{timer.name}')
+        self.pipeline = pipeline
+        self.timer = timer
+        self.inbound = inbound
+        self.outbound = outbound
+        self.source = source
+        self.func = func
+
+    def run(self):
+        try:
+            items = iter(self.source) if self.source is not None else None
+            while not self.pipeline.stopped:
+                if items is not None:
+                    start = time.perf_counter()
+                    item = next(items, _END)
+                    self.timer.busy += time.perf_counter() - start
+                else:
+                    item = self.pipeline.get(self.inbound, self.timer)
+                    if isinstance(item, _Failure):
+                        self.pipeline.put(self.outbound, item, self.timer)
+                        return
+                    if item is not _END:
+                        start = time.perf_counter()
+                        item = self.func(item)
+                        self.timer.busy += time.perf_counter() - start
+                if item is _END:
+                    self.pipeline.put(self.outbound, _END, self.timer)
+                    return
+                self.timer.items += 1
+                self.pipeline.put(self.outbound, item, self.timer)
+        except Exception as ex:
+            self.pipeline.put(self.outbound, _Failure(ex), self.timer)
+
+
+class Pipeline(object):
+    """
+    Chain of stages, each running in its own thread and joined by bounded queues so that network and
+    database I/O overlap while memory stays capped at roughly (depth * stages) items.
+
+    The last stage is consumed by iterating over the pipeline in the calling thread. Errors raised in any
+    stage are re-raised there.
+    """
+
+    def __init__(self, name: str, depth: int = 4):
+        self.name = name
+        self.depth = depth
+        self.timers: List[StageTimer] = list()
+        self._stages: List[_Stage] = list()
+        self._stop = threading.Event()
+        self._tail: Optional[queue.Queue] = None
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def source(self, name: str, items: Iterable):
+        assert len(self._stages) == 0
+        self._add(name, items, None)
+        return self
+
+    def stage(self, name: str, func: Callable):
+        assert len(self._stages) > 0
+        self._add(name, None, func)
+        return self
+
+    def _add(self, name: str, items: Optional[Iterable], func: Optional[Callable]):
+        timer = StageTimer(name)
+        outbound = queue.Queue(maxsize=self.depth)
+        self._stages.append(_Stage(self, timer, self._tail, outbound, items, func))
+        self.timers.append(timer)
+        self._tail = outbound
+
+    def get(self, q: queue.Queue, timer: StageTimer):
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    return q.get(timeout=0.5)
+                except queue.Empty:
+                    if self.stopped:
+                        return _END
+        finally:
+            timer.wait += time.perf_counter() - start
+
+    def put(self, q: queue.Queue, item, timer: StageTimer):
+        start = time.perf_counter()
+        try:
+            while not self.stopped:
+                try:
+                    q.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+        finally:
+            timer.wait += time.perf_counter() - start
+
+    def __iter__(self):
+        timer = StageTimer('apply')
+        self.timers.append(timer)
+        for stage in self._stages:
+            stage.start()
+        try:
+            while True:
+                item = self.get(self._tail, timer)
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.ex
+                timer.items += 1
+                start = time.perf_counter()
+                yield item
+                timer.busy += time.perf_counter() - start
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+        for stage in self._stages:
+            if stage.is_alive():
+                stage.join()
+
+    def report(self, log: logging.Logger):
+        for timer in self.timers:
+            log.info(f'{self.name} {timer}')
@@ -0,0 +1,273 @@
+#    Copyright 2018, 2019 Marshall L Smith Jr
+#
+#    This file is part of Gurglefish.
+#
+#    Gurglefish is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Gurglefish is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import datetime
+import logging
+import math
+import multiprocessing
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from gurglefish import asyncsfapi, tools
+from gurglefish.asyncsfapi import AsyncSFClient
+from gurglefish.context import Context
+from gurglefish.objects.checkpoint import KeyRange, SyncCheckpoint, SCOPE_RANGE
+from gurglefish.objects.files import LocalTableConfig
+from gurglefish.transformutils import py_timestamp
+
+__author__ = 'Marshall L Smith Jr'
+
+# used to turn record counts into seconds until there is history to measure it
+DEFAULT_SECONDS_PER_RECORD = 0.005
+# fixed cost of a table sync - schema check, count and first query
+SYNC_OVERHEAD_SECONDS = 2.0
+# tables whose newest local record is older than this are counted again, they may have a backlog to catch up
+CATCH_UP_AGE = datetime.timedelta(days=1)
+
+
+class TableEstimate(object):
+
+    def __init__(self, table: LocalTableConfig, seconds: float, source: str, key_range: Optional[KeyRange] = None,
+                 records: float = 0):
+        self.table = table
+        self.seconds = seconds
+        self.source = source
+        self.key_range = key_range
+        # expected number of changed records, counted or from recent runs
+        self.records = records
+
+    @property
+    def sort_key(self) -> Tuple[int, float]:
+        return -self.table.priority, -self.seconds
+
+
+class TableScheduler(object):
+    """
+    Orders tables for a sync run so the longest are started first and don't stretch out the end of the job.
+
+    Expected durations come from the recent history in gf_mdata_sync_stats. Tables without history, or
+    that have fallen behind, are estimated from the number of records to download. A table's configured
+    priority always wins over its expected duration.
+
+    Tables with more pending records than their split_threshold are divided into SystemModStamp ranges
+    that are synced by several workers at once. The planning process holds a shared lock on each table it
+    planned ranges for, listed in claimed, which the caller releases once all of them are done.
+    """
+
+    def __init__(self, context: Context):
+        self.context = context
+        self.log = logging.getLogger('scheduler')
+        self.claimed: Set[str] = set()
+
+    def plan(self, tables: List[LocalTableConfig], jobid, workers: int) -> List[TableEstimate]:
+        db = self.context.dbdriver
+        history: Dict[str, Tuple[float, float]] = db.get_sync_history()
+
+        total_seconds = sum(seconds for seconds, _ in history.values())
+        total_rows = sum(rows for _, rows in history.values())
+        per_record = DEFAULT_SECONDS_PER_RECORD
+        if total_rows > 0:
+            per_record = total_seconds / total_rows
+        behind = datetime.datetime.utcnow() - CATCH_UP_AGE
+
+        estimates: List[TableEstimate] = list()
+        to_count: Dict[str, Tuple[LocalTableConfig, Optional[datetime.datetime]]] = dict()
+        for table in tables:
+            name = table.name.lower()
+            seconds, rows = history.get(name, (SYNC_OVERHEAD_SECONDS, 0))
+
+            # finish the ranges of a split sync that was interrupted before starting anything new
+            leftover = db.list_checkpoints(name, SCOPE_RANGE)
+            if len(leftover) > 0:
+                if not self.claim(name):
+                    self.log.warning(f'{name} is being synced by another run - skipping')
+                    continue
+                # read them again now nothing else can be working on them
+                leftover = db.list_checkpoints(name, SCOPE_RANGE)
+                if len(leftover) == 0:
+                    self.release(name)
+            if len(leftover) > 0:
+                self.log.info(f'{name}: resuming {len(leftover)} unfinished range(s)')
+                for checkpoint in leftover:
+                    estimates.append(TableEstimate(table, seconds / len(leftover), 'resume',
+                                                   KeyRange.from_scope(checkpoint.scope), rows / len(leftover)))
+                continue
+
+            timestamp = db.max_timestamp(name)
+            if name in history and timestamp is not None and timestamp >= behind:
+                estimates.append(TableEstimate(table, seconds, 'history', records=rows))
+                continue
+            to_count[name] = (table, timestamp)
+
+        counts = self.count_records(dict((name, f'SystemModStamp >= {tools.sf_timestamp(timestamp)}'
+                                          if timestamp is not None else None)
+                                         for name, (_, timestamp) in to_count.items()))
+        for name, (table, timestamp) in to_count.items():
+            count = counts.get(name) or 0
+            seconds = SYNC_OVERHEAD_SECONDS + count * per_record
+
+            if workers > 1 and 0 < table.split_threshold < count:
+                if not self.claim(name):
+                    self.log.warning(f'{name} is being synced by another run - skipping')
+                    continue
+                parts = min(workers, math.ceil(count / table.split_threshold))
+                ranges = self.split(name, timestamp, count, parts)
+                if len(ranges) <= 1:
+                    self.release(name)
+                else:
+                    self.log.info(f'{name}: {count} records to sync, split into {len(ranges)} ranges')
+                    with db.cursor as cur:
+                        for key_range in ranges:
+                            db.save_checkpoint(cur, SyncCheckpoint.create(name, key_range.scope, jobid,
+                                                                            timestamp is None))
+                    db.commit()
+                    for key_range in ranges:
+                        estimates.append(TableEstimate(table, seconds / len(ranges), 'count', key_range,
+                                                       count / len(ranges)))
+                    continue
+            estimates.append(TableEstimate(table, seconds, 'count', records=count))
+
+        estimates.sort(key=lambda e: e.sort_key)
+        for estimate in estimates:
+            self.log.debug(f'{estimate.table.name} {estimate.key_range or ""}: priority {estimate.table.priority}, '
+                           f'expected {estimate.seconds:.1f}s ({estimate.source})')
+        return estimates
+
+    def claim(self, name: str) -> bool:
+        """
+        Take the table for a sync in ranges if no other run is syncing it. Its workers share the lock, so
+        another run can't plan the same ranges while any of them is queued or running.
+        """
+        db = self.context.dbdriver
+        if name in self.claimed:
+            return True
+        if not db.lock_table(name):
+            return False
+        db.lock_table(name, shared=True)
+        db.unlock_table(name)
+        self.claimed.add(name)
+        return True
+
+    def release(self, name: str):
+        if name in self.claimed:
+            self.claimed.remove(name)
+            self.context.dbdriver.unlock_table(name, shared=True)
+
+    def count_records(self, filters: Dict[str, Optional[str]]) -> Dict[str, Optional[int]]:
+        """
+        record_count for several tables, all at once when the async client is available.
+        """
+        sfclient = self.context.sfclient
+        if len(filters) < 2 or not asyncsfapi.available():
+            return dict((name, sfclient.record_count(name, query_filter)) for name, query_filter in filters.items())
+
+        async def count_all(client: AsyncSFClient):
+            async with client:
+                return await asyncio.gather(*[client.record_count(name, query_filter)
+                                              for name, query_filter in filters.items()])
+
+        client = AsyncSFClient(sfclient, self.context.env.api_concurrency)
+        loop = asyncio.new_event_loop()
+        try:
+            counts = loop.run_until_complete(count_all(client))
+        finally:
+            loop.close()
+        sfclient.calls += client.calls
+        return dict(zip(filters.keys(), counts))
+
+    def split(self, name: str, start: Optional[datetime.datetime], count: int, parts: int) -> List[KeyRange]:
+        """
+        Divide the records of a table modified since start into about parts ranges of similar size, by
+        repeatedly halving the fullest SystemModStamp window and counting one half.
+        """
+        sfclient = self.context.sfclient
+        low = start
+        if low is None:
+            first = list(sfclient.query(f'select SystemModstamp from {name} order by SystemModstamp asc limit 1'))
+            if len(first) == 0:
+                return [KeyRange(None, None)]
+            low = py_timestamp(first[0]['SystemModstamp'])
+        high = datetime.datetime.utcnow().replace(microsecond=0)
+
+        # each window is [low, high, records]
+        windows = [[low, high, count]]
+        for _ in range(parts * 4):
+            if sum(1 for w in windows if w[2] > 0) >= parts:
+                break
+            fullest = max(windows, key=lambda w: w[2])
+            low, high, records = fullest
+            if (high - low).total_seconds() < 2:
+                break
+            middle = (low + (high - low) / 2).replace(microsecond=0)
+            left = sfclient.record_count(name, f'SystemModStamp >= {tools.sf_timestamp(low)} and '
+                                               f'SystemModStamp < {tools.sf_timestamp(middle)}') or 0
+            pos = windows.index(fullest)
+            windows[pos:pos + 1] = [[low, middle, left], [middle, high, max(records - left, 0)]]
+
+        # empty windows are folded into the range before them, the first and last ranges are left open
+        bounds = [w[0] for w in windows if w[2] > 0][1:]
+        starts = [start] + bounds
+        ends = bounds + [None]
+        return [KeyRange(s, e) for s, e in zip(starts, ends)]
+
+
+class WorkSlots(object):
+    """
+    Pool of worker slots shared by sync processes. A table with a weight greater than 1 holds that many
+    slots while it runs, so fewer tables run alongside it.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._slots = multiprocessing.BoundedSemaphore(size)
+        self._lock = multiprocessing.Lock()
+        # pid of the process holding _lock while it waits for slots
+        self._owner = multiprocessing.Value('i', 0, lock=False)
+
+    def acquire(self, weight: int, tally=None) -> int:
+        """
+        Block until weight slots are free.
+
+        :param tally: shared Value counting the slots taken so far, so they can be reclaimed if the caller dies
+        :return: number of slots actually taken, to pass to release()
+        """
+        weight = max(1, min(weight, self.size))
+        # take all the slots at once so two heavy tables can't each hold part of what the other needs
+        with self._lock:
+            self._owner.value = os.getpid()
+            for _ in range(weight):
+                self._slots.acquire()
+                if tally is not None:
+                    tally.value += 1
+            self._owner.value = 0
+        return weight
+
+    def release(self, weight: int, tally=None):
+        for _ in range(weight):
+            # count down first, a slot is better leaked than released twice
+            if tally is not None:
+                tally.value -= 1
+            self._slots.release()
+
+    def reclaim(self, pid: int, held: int):
+        """
+        Give back the slots, and the lock if it was waiting on them, of a worker process that died.
+        """
+        self.release(held)
+        if self._owner.value == pid:
+            self._owner.value = 0
+            self._lock.release()
@@ -18,7 +18,7 @@ import logging
 from typing import Dict
 
 from gurglefish import FileManager
-from gurglefish.DriverManager import DbDriverMeta
+from gurglefish.DriverManager import DbDriverMeta, ROW_HASH_COLUMN
 from gurglefish.context import Context
 from gurglefish.objects.files import LocalTableConfig
 from gurglefish.objects.sobject import ColumnMap
@@ -140,12 +140,23 @@ class SFSchemaManager:
             if not self.driver.table_exists(sobject_name):
                 self.log.info(f'  creating {sobject_name}')
                 self.driver.exec_ddl(create_table_dml)
+                self.driver.clear_table_cache()
                 self.log.info(f'  creating indexes')
                 self.driver.maintain_indexes(sobject_name, fields)
         except Exception as ex:
             print(ex)
             raise ex
 
+    def refresh_transformer(self, sobject_name: str):
+        """
+        Regenerate the transformer from the saved column map, for transformers created by an older version.
+        """
+        sobject_name = sobject_name.lower()
+        fieldmap: [ColumnMap] = self.filemgr.get_sobject_map(sobject_name)
+        parser = self.driver.make_transformer(sobject_name, sobject_name, fieldmap)
+        self.filemgr.save_sobject_transformer(sobject_name, parser)
+        self.driver.clear_table_cache()
+
     def update_sobject_definition(self, sobject_name: str, allow_add=True, allow_drop=True):
         sobject_name = sobject_name.lower()
 
@@ -155,7 +166,7 @@ class SFSchemaManager:
         #
         # check for added/dropped columns
         #
-        table_field_names = set([tbl['column_name'] for tbl in table_columns])
+        table_field_names = set([tbl['column_name'] for tbl in table_columns if tbl['column_name'] != ROW_HASH_COLUMN])
         new_field_names = sobj_columns.names() - table_field_names
         dropped_fields = table_field_names - sobj_columns.names()
 
@@ -14,19 +14,136 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import csv
+import datetime
+import email.utils
 import logging
 import json
+import multiprocessing
 import operator
+import queue
+import random
+import threading
 import time
-from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
 import requests
+import urllib3
 from fastcache import lru_cache
 
+from gurglefish import csvstream, fastjson
+
+from gurglefish.governor import ApiGovernor
 from gurglefish.objects.sobject import SObjectFields
 
 MAX_BATCH_SIZE = 100
 _API_VERSION = '44.0'
+# Bulk API 2.0 queries need at least 47.0
+_BULK2_API_VERSION = '47.0'
+
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+RETRY_ERROR_CODES = ('UNABLE_TO_LOCK_ROW', 'REQUEST_LIMIT_EXCEEDED', 'SERVER_UNAVAILABLE')
+# methods sent again after any transient failure, PATCH is only used to change the state of a job
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PATCH', 'PUT', 'DELETE')
+# bytes read at a time when streaming a response
+STREAM_CHUNK_SIZE = 64 * 1024
+# seconds between checks on a running bulk job, growing from the first to the second
+BULK_POLL_MIN = 2.0
+BULK_POLL_MAX = 120.0
+# completed batches of a bulk job downloaded at once, and records handed over from them at a time
+BULK_DOWNLOAD_THREADS = 4
+BULK_BLOCK_SIZE = 1000
+# room for an access token shared by worker processes, Salesforce's are a little over 100 characters
+MAX_TOKEN_LENGTH = 2048
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Seconds to wait before retry number attempt (from 0): exponential backoff with full jitter, but never
+    less than a Retry-After header asks for, up to MAX_BACKOFF. A Retry-After that can't be read is ignored.
+    """
+    delay = random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+    if retry_after is not None:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(retry_after)
+                delay = max(delay, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+            except (TypeError, ValueError, IndexError, OverflowError):
+                pass
+    return min(delay, MAX_BACKOFF)
+
+
+def is_retryable(status: int, body: str, method: str = 'GET') -> bool:
+    """
+    True if a failed request may succeed when sent again. Other requests, such as those creating a bulk job,
+    are only sent again when Salesforce turned them away, not on an error that may have come after the job
+    was created.
+    """
+    if any(code in body for code in RETRY_ERROR_CODES):
+        return True
+    if method.upper() in IDEMPOTENT_METHODS:
+        return status in RETRY_STATUS
+    return status == 429
+
+
+def connect_failed(ex: requests.RequestException) -> bool:
+    """
+    True if a request failed before it reached Salesforce, so it is safe to send again whatever it does.
+    """
+    if isinstance(ex, requests.ConnectTimeout):
+        return True
+    reason = getattr(ex.args[0], 'reason', None) if len(ex.args) > 0 else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def resumable_stream(session: '_SFSession', url: str, parse: Callable, check: Callable = None, resume=True,
+                     **kwargs):
+    """
+    Yield the items parse(response) reads from a streamed GET of url. If the connection drops part way
+    through, the request is sent again and the items already yielded are skipped.
+
+    :param check: called with the response before it is read, raises if it failed (raise_for_status by default)
+    :param resume: False if sending the request again may give different items, as running a query does.
+                   The request is then only sent again if nothing was yielded yet.
+    """
+    delivered = 0
+    attempt = 0
+    while True:
+        response = session.get(url, stream=True, **kwargs)
+        if check is not None:
+            check(response)
+        else:
+            response.raise_for_status()
+        count = 0
+        try:
+            for item in parse(response):
+                count += 1
+                if count > delivered:
+                    delivered = count
+                    yield item
+            return
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as ex:
+            if attempt >= session.max_retries or (not resume and delivered > 0):
+                raise
+            delay = backoff_delay(attempt)
+            logging.getLogger('salesforce').warning(f'download of {url} failed after {delivered} items ({ex}), '
+                                                    f'retrying in {delay:.1f}s')
+            time.sleep(delay)
+            attempt += 1
+
+
+def escape_soql(soql: str) -> str:
+    """
+    Need to make specific changes to soql to avoid upsetting Salesforce and
+    using requests built-in escaping causes problems.
+    """
+    return soql.replace('+', '%2b').replace('\n', '').replace('\r', '').replace(' ', '+')
 
 
 class SFQueryTooLarge(Exception):
@@ -34,6 +151,16 @@ class SFQueryTooLarge(Exception):
         super().__init__(self)
 
 
+class SFQueryLocatorExpired(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class SFBulkJobFailed(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
 class JobBatch:
 
     def __init__(self, batchinfo: Dict, parent):
@@ -53,35 +180,22 @@ class JobBatch:
         response = self.parent.client.get(
             f'{self.parent.service_url}/services/async/{_API_VERSION}/job/{self.parent.job_id}/batch/{self.batch_id}/result')
         response.raise_for_status()
-        self.client.calls += 1
 
-        result = json.loads(response.text)
+        result = fastjson.loads(response.content)
         for resultid in result:
-            response = self.parent.client.get(
-                f'{self.parent.service_url}/services/async/{_API_VERSION}/job/{self.parent.job_id}/batch/{self.batch_id}/result/{resultid}',
-                stream=True)
-            self.client.calls += 1
-            doc = ''
-            for chunk in response.iter_lines():
-                if chunk is None:
-                    continue
-                chunk = chunk.decode('utf-8')
-                if chunk[0] == '[':
-                    doc = '{'
-                elif chunk[0] == '}':
-                    doc += '}'
-                    yield json.loads(doc)
-                    doc = '{'
-                else:
-                    doc += chunk
+            url = f'{self.parent.service_url}/services/async/{_API_VERSION}/job/{self.parent.job_id}/batch/{self.batch_id}/result/{resultid}'
+            yield from resumable_stream(self.parent.client, url, JobBatch._parse_records)
+
+    @staticmethod
+    def _parse_records(response):
+        return fastjson.iter_items(response.iter_content(STREAM_CHUNK_SIZE))
 
     def refresh(self):
         if self.state != 'Completed':
             response = self.parent.client.get(
                 f'{self.parent.service_url}/services/async/{_API_VERSION}/job/{self.parent.job_id}/batch/{self.batch_id}')
-            self.client.calls += 1
             response.raise_for_status()
-            self.batchinfo = json.loads(response.text)
+            self.batchinfo = fastjson.loads(response.content)
             return True
         return False
 
@@ -118,9 +232,8 @@ class BulkJob:
         response = self.client.post(f'{self.service_url}/services/async/{_API_VERSION}/job/{self.job_id}/batch',
                                     data=json.dumps(payload, indent=4),
                                     headers={'Content-Type': 'application/json; charset=UTF-8'})
-        self.client.calls += 1
         response.raise_for_status()
-        result = json.loads(response.text)
+        result = fastjson.loads(response.content)
         return JobBatch(result, self)
 
     @property
@@ -131,9 +244,8 @@ class BulkJob:
         response = self.client.post(f'{self.service_url}/services/async/{_API_VERSION}/job/{self.job_id}/batch',
                                     data=soql + ' ',
                                     headers={'Content-Type': 'application/json; charset=UTF-8'})
-        self.client.calls += 1
         response.raise_for_status()
-        result = json.loads(response.text)
+        result = fastjson.loads(response.content)
         batch = JobBatch(result, self)
         self.pending.append(batch)
         return batch
@@ -178,9 +290,8 @@ class BulkJob:
     #
     def refresh(self):
         response = self.client.get(f'{self.service_url}/services/async/{_API_VERSION}/job/{self.job_id}')
-        self.client.calls += 1
         response.raise_for_status()
-        self.jobinfo = json.loads(response.text)
+        self.jobinfo = fastjson.loads(response.content)
 
     #
     # Returns:
@@ -204,9 +315,8 @@ class BulkJob:
     #
     def get_batches(self) -> [Dict]:
         response = self.client.get(f'{self.service_url}/services/async/{_API_VERSION}/job/{self.job_id}/batch')
-        self.client.calls += 1
         response.raise_for_status()
-        result = json.loads(response.text)
+        result = fastjson.loads(response.content)
         self.pending: [JobBatch] = list()
         for bi in result['batchInfo']:
             if bi['id'] not in self.complete:
@@ -219,6 +329,35 @@ class BulkJob:
     def release_batch(self, batch_id: str):
         self.complete.append(batch_id)
 
+    def batches(self) -> List[JobBatch]:
+        """
+        All batches of the job with their current state, in one call.
+        """
+        response = self.client.get(f'{self.service_url}/services/async/{_API_VERSION}/job/{self.job_id}/batch')
+        response.raise_for_status()
+        return [JobBatch(bi, self) for bi in fastjson.loads(response.content)['batchInfo']]
+
+    @staticmethod
+    def hand_over(blocks: queue.Queue, block, stop: threading.Event) -> bool:
+        """
+        Pass a block of downloaded records (or the error that ended the download) to the consumer.
+
+        :return: False if the consumer stopped first
+        """
+        while not stop.is_set():
+            try:
+                blocks.put(block, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @staticmethod
+    def unpack(block):
+        if isinstance(block, Exception):
+            raise block
+        return block
+
     def get_completed_batch(self) -> Optional[JobBatch]:
         self.get_batches()
         for batch in self.pending:
@@ -229,24 +368,233 @@ class BulkJob:
     def close(self):
         response = self.client.post(f'{self.service_url}/services/async/{_API_VERSION}/job/{self.job_id}',
                                     data='{"state":"Closed"}')
-        self.client.calls += 1
         response.raise_for_status()
-        result = json.loads(response.text)
+        result = fastjson.loads(response.content)
         return result
 
 
+class Bulk2QueryJob:
+    """
+    Query job of the Bulk API 2.0. Salesforce splits up the work itself so there are no batches to track,
+    results are paged through with a locator.
+    """
+    STATES_RUNNING = ('UploadComplete', 'InProgress')
+    STATES_ACTIVE = ('UploadComplete', 'InProgress', 'JobComplete')
+
+    def __init__(self, jobinfo: Dict, client, service_url):
+        self.job_id = jobinfo['id']
+        self.jobinfo = jobinfo
+        self.client = client
+        self.service_url = service_url
+        self.url = f'{service_url}/services/data/v{_BULK2_API_VERSION}/jobs/query/{self.job_id}'
+
+    @property
+    def state(self) -> str:
+        return self.jobinfo['state']
+
+    def refresh(self):
+        response = self.client.get(self.url)
+        response.raise_for_status()
+        self.jobinfo = fastjson.loads(response.content)
+
+    def wait(self, timeout: int):
+        """
+        Wait for Salesforce to finish running the query, checking often at first and less often the
+        longer it takes.
+
+        :raises SFBulkJobFailed: if the job failed, was aborted or didn't finish in time
+        """
+        waited = 0
+        delay = BULK_POLL_MIN
+        while self.state in Bulk2QueryJob.STATES_RUNNING and waited < timeout:
+            time.sleep(delay)
+            waited += delay
+            delay = min(delay * 1.5, BULK_POLL_MAX)
+            self.refresh()
+        if self.state != 'JobComplete':
+            raise SFBulkJobFailed(f'Bulk query job {self.job_id} is {self.state} after {waited:.0f} seconds '
+                                  f'{self.jobinfo.get("errorMessage") or ""}')
+
+    def results(self, max_records: int = 0):
+        """
+        Yield the records of a completed job, a page at a time.
+
+        :param max_records: most records per page, 0 to let Salesforce decide
+        """
+        rows = self.rows(max_records)
+        header = next(rows, None)
+        for row in rows:
+            yield dict(zip(header, [value if value != '' else None for value in row]))
+
+    def rows(self, max_records: int = 0):
+        """
+        Yield the CSV rows of a completed job as lists of strings: the column names first, then every
+        record. Salesforce writes nulls as empty values.
+
+        :param max_records: most records per page, 0 to let Salesforce decide
+        """
+        locator = None
+        header = None
+        while True:
+            params = dict()
+            if max_records > 0:
+                params['maxRecords'] = max_records
+            if locator is not None:
+                params['locator'] = locator
+            page = dict()
+
+            def parse(response):
+                page['locator'] = response.headers.get('Sforce-Locator', None)
+                reader = csv.reader(csvstream.text_reader(response.iter_content(STREAM_CHUNK_SIZE)))
+                # every page starts with the column names
+                page['header'] = next(reader, None)
+                return reader
+
+            for row in resumable_stream(self.client, f'{self.url}/results', parse, params=params,
+                                        headers={'Accept': 'text/csv'}):
+                if header is None:
+                    header = page['header']
+                    yield header
+                yield row
+            if header is None and page.get('header') is not None:
+                header = page['header']
+                yield header
+            locator = page['locator']
+            if locator in (None, '', 'null'):
+                break
+
+
+class _SFSession(requests.Session):
+    """
+    HTTP session that counts the requests it sends and keeps them within the API governor's limits. Logs in
+    again when Salesforce reports the access token has expired, and retries requests that failed with a
+    transient error after a backoff delay. May be shared by threads, as bulk result downloads are.
+    """
+
+    def __init__(self, on_expired: Callable[[], bool], poll_limits: Callable[[], None], governor=None,
+                 max_retries: int = MAX_RETRIES):
+        super().__init__()
+        self.on_expired = on_expired
+        self.poll_limits = poll_limits
+        self.governor = governor
+        self.max_retries = max_retries
+        self.calls = 0
+        self.log = logging.getLogger('salesforce')
+        # guards calls and logging in again
+        self._lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs):
+        attempt = 0
+        refreshed = False
+        while True:
+            if self.governor is not None:
+                self.admit()
+            token = self.headers.get('Authorization', None)
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as ex:
+                if attempt >= self.max_retries or not (method.upper() in IDEMPOTENT_METHODS or connect_failed(ex)):
+                    raise
+                delay = backoff_delay(attempt)
+                self.log.warning(f'{method} {url} failed ({ex}), retrying in {delay:.1f}s')
+                time.sleep(delay)
+                attempt += 1
+                continue
+            with self._lock:
+                self.calls += 1
+            if self.governor is not None:
+                self.governor.observe_header(response.headers.get('Sforce-Limit-Info', None))
+            if response.status_code < 400:
+                return response
+
+            # the bulk API reports an expired session as a 400 with an InvalidSessionId exception code
+            expired = response.status_code == 401 or \
+                (response.status_code == 400 and 'InvalidSessionId' in response.text)
+            if expired and not refreshed and self.renew(token):
+                refreshed = True
+                continue
+            if attempt < self.max_retries and is_retryable(response.status_code, response.text, method):
+                delay = backoff_delay(attempt, response.headers.get('Retry-After', None))
+                self.log.warning(f'{method} {url} failed ({response.status_code}), retrying in {delay:.1f}s')
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return response
+
+    def renew(self, token: Optional[str]) -> bool:
+        """
+        Log in again after a request sent with token found it expired, unless another thread already has.
+
+        :return: True if there is a new token to retry with
+        """
+        with self._lock:
+            if self.headers.get('Authorization', None) != token:
+                return True
+            return self.on_expired()
+
+    def admit(self):
+        while True:
+            if self.governor.needs_poll():
+                self.poll_limits()
+            wait, paused = self.governor.next_wait()
+            if wait > 0:
+                time.sleep(wait)
+            if not paused:
+                return
+
+
+class SharedToken(object):
+    """
+    Access token shared by a process and the workers it forks. When it expires one of them logs in again,
+    and the others pick up the new token the next time theirs is refused rather than each logging in.
+    """
+
+    def __init__(self, token: str):
+        self.lock = multiprocessing.Lock()
+        self._token = multiprocessing.Array('c', MAX_TOKEN_LENGTH, lock=False)
+        self.value = token
+
+    @property
+    def value(self) -> str:
+        return self._token.value.decode('ascii')
+
+    @value.setter
+    def value(self, token: str):
+        self._token.value = token.encode('ascii')
+
+
 class SFClient:
 
-    def __init__(self):
+    def __init__(self, governor: ApiGovernor = None, max_retries: int = MAX_RETRIES):
         self.log = logging.getLogger('salesforce')
+        self.max_retries = max_retries
         self.access_token = None
         self.service_url = None
-        self.client = None
+        self.client: _SFSession = None
         self._username = None
-        self.calls = 0
+        self.credentials: Optional[Tuple] = None
+        self.shared_token: Optional[SharedToken] = None
+        self.governor = governor
+
+    @property
+    def calls(self) -> int:
+        """
+        Number of requests sent, including those of bulk jobs created by this client.
+        """
+        return self.client.calls if self.client is not None else 0
+
+    @calls.setter
+    def calls(self, val: int):
+        self.client.calls = val
 
     def login(self, consumer_key, consumer_secret, username, password, server_url):
         self._username = username
+        self.credentials = (consumer_key, consumer_secret, username, password, server_url)
+        token, instance_url = SFClient.authenticate(*self.credentials)
+        self.construct(token, instance_url, self.credentials)
+
+    @staticmethod
+    def authenticate(consumer_key, consumer_secret, username, password, server_url) -> Tuple[str, str]:
         payload = {'grant_type': 'password',
                    'username': username,
                    'password': password,
@@ -259,16 +607,58 @@ class SFClient:
         if 'error' in payload:
             raise Exception(payload['error_description'])
         # self.log.debug('payload=%s' % (rsp.text,))
-        self.construct(payload['access_token'], payload['instance_url'])
+        return payload['access_token'], payload['instance_url']
 
-    def construct(self, token, server_url):
-        self.access_token = token
+    def construct(self, token, server_url, credentials: Optional[Tuple] = None, shared_token: SharedToken = None):
+        """
+        Use an existing session, such as one obtained by another process.
+
+        :param credentials: login() arguments used to get a new token when this one expires, if any
+        :param shared_token: token of the client this one was made for in a worker process, renewed for both
+        """
         self.service_url = server_url
-        self.client = requests.Session()
-        self.client.headers.update({'Authorization': 'OAuth ' + token,
-                                    'X-SFDC-Session': token,
-                                    'Content-Type': 'application/json; charset=UTF-8',
+        if credentials is not None:
+            self.credentials = credentials
+        self.shared_token = shared_token or SharedToken(token)
+        self.client = _SFSession(self.refresh, self.poll_limits, self.governor, self.max_retries)
+        self.client.headers.update({'Content-Type': 'application/json; charset=UTF-8',
                                     'Accept-Encoding': 'gzip, compress, deflate', 'Accept-Charset': 'utf-8'})
+        self._use_token(token)
+
+    def _use_token(self, token):
+        self.access_token = token
+        self.client.headers.update({'Authorization': 'OAuth ' + token, 'X-SFDC-Session': token})
+
+    def refresh(self) -> bool:
+        """
+        Log in again after the access token expired.
+
+        :return: True if there is a new token to retry with
+        """
+        with self.shared_token.lock:
+            if self.shared_token.value != self.access_token:
+                # another process has logged in again already
+                self._use_token(self.shared_token.value)
+                return True
+            if self.credentials is None:
+                return False
+            self.log.info('session expired, logging in again')
+            token, _ = SFClient.authenticate(*self.credentials)
+            self.shared_token.value = token
+        self._use_token(token)
+        return True
+
+    def poll_limits(self):
+        """
+        Update the governor from the /limits resource. Sent around the governor so it can't wait on itself.
+        """
+        response = requests.Session.request(self.client, 'GET',
+                                            f'{self.service_url}/services/data/v{_API_VERSION}/limits/')
+        if response.status_code == 200:
+            self.governor.observe_limits(response.json())
+        else:
+            self.log.warning(f'unable to get API limits: {response.status_code} {response.text}')
+            self.governor.observe_limits({})
 
     def close(self):
         pass
@@ -307,67 +697,96 @@ class SFClient:
             self.log.error(f'query error {response.status_code}, {response.reason}')
             self.log.error(result_payload)
             return
-        self.calls += 1
         return result_payload['totalSize']
 
-    def query(self, soql: str, include_deleted=False):
+    def query(self, soql: str, include_deleted=False, stream=False):
+        """
+        Yield the records of a query, all pages of them.
+
+        :param stream: yield records while each page is still being downloaded and parsed, rather than
+                       reading the whole page first. Less memory is used and the first records of a page
+                       arrive sooner.
+        """
+        if stream:
+            yield from self.query_stream(soql, include_deleted)
+            return
+        for page, _ in self.query_pages(soql, include_deleted):
+            for rec in page:
+                yield rec
+
+    def query_stream(self, soql: str, include_deleted=False):
         resource = 'queryAll' if include_deleted else 'query'
-        fullurl = f'{self.service_url}/services/data/v{_API_VERSION}/{resource}/'
-        #
-        # Need to make specific changes to soql to avoid upsetting Salesforce and
-        # using requests built-in escaping causes problems.
-        #
-        soql = soql.replace('+', '%2b').replace('\n', '').replace('\r', '').replace(' ', '+')
-        response = self.client.get(fullurl, params=f'q={soql}')
-        result_payload = response.text
+        url = f'{self.service_url}/services/data/v{_API_VERSION}/{resource}/'
+        params = f'q={escape_soql(soql)}'
+        while url is not None:
+            envelope = dict()
+            # running the query again starts a new result set, only a nextRecordsUrl page reads the same one
+            yield from resumable_stream(self.client, url,
+                                        lambda r: fastjson.iter_items(r.iter_content(STREAM_CHUNK_SIZE),
+                                                                      'records', envelope),
+                                        self._check_query, resume=params is None, params=params)
+            next_records_url = envelope.get('nextRecordsUrl', None)
+            url = f'{self.service_url}{next_records_url}' if next_records_url else None
+            params = None
+
+    def _check_query(self, response):
         if response.status_code == 431:
             raise SFQueryTooLarge()
-        self.calls += 1
         if response.status_code != 200:
             self.log.error(f'query error {response.status_code}, {response.reason}')
-            self.log.error(result_payload)
-            return
-        data = json.loads(result_payload)
-        recs = data['records']
-        for rec in recs:
-            yield (rec)
+            self.log.error(response.text)
+            response.raise_for_status()
+
+    def query_pages(self, soql: Optional[str], include_deleted=False, locator: str = None):
+        """
+        Same as query() but yields each page of records as a list, as returned by Salesforce, along
+        with the nextRecordsUrl locator for the following page (None on the last page).
+
+        :param locator: resume paging from a nextRecordsUrl saved earlier instead of running soql
+        """
+        if locator is not None:
+            response = self.client.get(f'{self.service_url}{locator}')
+            if response.status_code != 200:
+                raise SFQueryLocatorExpired(f'{response.status_code}: {response.text}')
+        else:
+            resource = 'queryAll' if include_deleted else 'query'
+            fullurl = f'{self.service_url}/services/data/v{_API_VERSION}/{resource}/'
+            response = self.client.get(fullurl, params=f'q={escape_soql(soql)}')
+            if response.status_code == 431:
+                raise SFQueryTooLarge()
+            if response.status_code != 200:
+                self.log.error(f'query error {response.status_code}, {response.reason}')
+                self.log.error(response.text)
+                return
+        data = fastjson.loads(response.content)
+        yield data['records'], data.get('nextRecordsUrl', None)
         while 'nextRecordsUrl' in data:
             next_records_url = data['nextRecordsUrl']
             if next_records_url:
+                # the session retries a failed page, picking up from this same locator
                 response = self.client.get('%s%s' % (self.service_url, next_records_url))
-                self.calls += 1
-                txt = response.text
-                if isinstance(txt, str):
-                    result_payload = txt
-                else:
-                    result_payload = str(txt, 'utf-8')
-                data = json.loads(result_payload)
-                recs = data['records']
-                for rec in recs:
-                    yield (rec)
+                response.raise_for_status()
+                data = fastjson.loads(response.content)
+                yield data['records'], data.get('nextRecordsUrl', None)
             else:
                 break
 
     def _get(self, url, url_params):
         fullurl = f'{self.service_url}/services/data/v{_API_VERSION}/{url}'
         response = self.client.get(fullurl, params=url_params)
-        result_payload = response.text
-        self.calls += 1
         if response.status_code != 200:
             self.log.debug('get %s', fullurl)
         response.raise_for_status()
-        data = json.loads(result_payload)
+        data = fastjson.loads(response.content)
         return data
 
     def _post(self, url, url_params):
         fullurl = f'{self.service_url}/services/data/v{_API_VERSION}/{url}'
         response = self.client.post(fullurl, params=url_params)
-        self.calls += 1
         if response.status_code != 200:
             self.log.debug('post %s', fullurl)
-        result_payload = response.text
         response.raise_for_status()
-        data = json.loads(result_payload)
+        data = fastjson.loads(response.content)
         return data
 
     def add_header(self, name: str, val: str):
@@ -384,53 +803,168 @@ class SFClient:
         self.client.headers['Content-Type'] = 'application/json; charset=UTF-8'
         response = self.client.post(url, data=json.dumps(payload),
                                     headers={'Content-Type': 'application/json; charset=UTF-8'})
-        self.calls += 1
         response.raise_for_status()
         result = response.json()
         if result['state'] != 'Open':
             raise Exception('Invalid job state: {}'.format(result['state']))
         return BulkJob(result, self.client, self.service_url)
 
-    def bulk_query(self, sobject: str, soql: str, job_id=None, timeout=600):
+    def bulk_job_state(self, job_id: str) -> Optional[str]:
+        """
+        :return: state of an existing bulk job, or None if Salesforce no longer knows about it
+        """
+        response = self.client.get(f'{self.service_url}/services/async/{_API_VERSION}/job/{job_id}')
+        if response.status_code != 200:
+            return None
+        return response.json()['state']
+
+    def bulk_query(self, sobject: str, soql: str, job_id=None, timeout=600, job_started: Callable = None,
+                   download_threads: int = BULK_DOWNLOAD_THREADS):
+        """
+        Run soql as a bulk query job, or pick up the results of an existing job if job_id is given.
 
+        :param job_started: called with the id of a newly created job, so callers can record it
+        :param download_threads: how many completed batches to download at once
+        """
         if job_id is None:
             job = self.create_job(BulkJob.JOB_OP_QUERY, sobject)
-            main_batch = job.bulk_query(soql + ' ')
+            job.bulk_query(soql + ' ')
             job.close()
+            if job_started is not None:
+                job_started(job.job_id)
             self.log.info(f'Waiting on bulk query job to start, timeout is {timeout} seconds')
-
-            # suppress annoying requests debug logging
-            logging.getLogger('chardet.charsetprober').setLevel(logging.INFO)
-
-            if main_batch.wait_for_start(timeout):
-                counter = 0
-                batches = job.batch_count
-                job.release_batch(main_batch.id)
-                while not job.is_done():
-                    completed = job.get_completed_batch()
-                    if completed is not None:
-                        counter += 1
-                        self.log.debug(f'Processing batch {counter} of {batches}')
-                        for result in completed.get_results():
-                            del result['attributes']
-                            yield result
-                        job.release_batch(completed.id)
-                    else:
-                        time.sleep(30)
-            else:
-                self.log.error('Timed out waiting for bulk query job to start')
         else:
             job = BulkJob({'id': job_id, 'state': 'Closed'}, self.client, self.service_url)
-            counter = 1
-            while not job.is_done():
-                total = job.batch_count
-                completed = job.get_completed_batch()
-                if completed is not None:
-                    self.log.debug(f'Processing batch {completed.batch_id} - {counter} of {total}')
-                    for result in completed.get_results():
-                        del result['attributes']
-                        yield result
-                    job.release_batch(completed.id)
-                    counter += 1
+
+        # suppress annoying requests debug logging
+        logging.getLogger('chardet.charsetprober').setLevel(logging.INFO)
+
+        #
+        # Completed batches are downloaded by a pool of threads while the job is still running, and their
+        # records handed back here in blocks. The time between checks on the job is spent passing those
+        # records on, and grows while no batches complete.
+        #
+        blocks = queue.Queue(maxsize=download_threads * 2)
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=download_threads)
+        downloads = list()
+        started = False
+        waited = 0.0
+        delay = BULK_POLL_MIN
+        try:
+            while True:
+                batches = job.batches()
+                newly_completed = 0
+                for batch in batches:
+                    if batch.state == 'Completed' and batch.id not in job.complete:
+                        job.release_batch(batch.id)
+                        newly_completed += 1
+                        self.log.debug(f'Downloading batch {len(job.complete)} of {len(batches)}')
+                        downloads.append(pool.submit(self._download_batch, batch, blocks, stop))
+                    elif batch.state == 'Failed':
+                        raise SFBulkJobFailed(f'Bulk query batch {batch.id} of job {job.job_id} failed: '
+                                              f'{batch.batchinfo.get("stateMessage", "")}')
+                running = [batch for batch in batches if batch.state in ('Queued', 'InProgress')]
+                started = started or any(batch.state != 'Queued' for batch in batches)
+                if len(running) == 0 and len(batches) > 0:
+                    break
+                if not started and waited >= timeout:
+                    raise SFBulkJobFailed(f'Timed out waiting for bulk query job {job.job_id} to start')
+
+                if newly_completed > 0:
+                    delay = max(BULK_POLL_MIN, delay / 2)
                 else:
-                    time.sleep(20)
+                    delay = min(delay * 1.5, BULK_POLL_MAX)
+                until = time.monotonic() + delay
+                while True:
+                    remaining = until - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        block = blocks.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    yield from BulkJob.unpack(block)
+                waited += delay
+
+            # job is finished, pass on the rest of what is being downloaded
+            while not all(download.done() for download in downloads) or not blocks.empty():
+                try:
+                    block = blocks.get(timeout=1)
+                except queue.Empty:
+                    continue
+                yield from BulkJob.unpack(block)
+            for download in downloads:
+                download.result()
+        finally:
+            stop.set()
+            pool.shutdown(wait=True)
+
+    @staticmethod
+    def _download_batch(batch: JobBatch, blocks: queue.Queue, stop: threading.Event):
+        block = list()
+        try:
+            for result in batch.get_results():
+                del result['attributes']
+                block.append(result)
+                if len(block) >= BULK_BLOCK_SIZE:
+                    if not BulkJob.hand_over(blocks, block, stop):
+                        return
+                    block = list()
+            if len(block) > 0:
+                BulkJob.hand_over(blocks, block, stop)
+        except Exception as ex:
+            BulkJob.hand_over(blocks, ex, stop)
+            raise
+
+    def create_query_job(self, soql: str, include_deleted=False) -> Bulk2QueryJob:
+        payload = {'operation': 'queryAll' if include_deleted else 'query', 'query': soql,
+                   'contentType': 'CSV', 'columnDelimiter': 'COMMA', 'lineEnding': 'LF'}
+        response = self.client.post(f'{self.service_url}/services/data/v{_BULK2_API_VERSION}/jobs/query',
+                                    data=json.dumps(payload),
+                                    headers={'Content-Type': 'application/json; charset=UTF-8'})
+        response.raise_for_status()
+        return Bulk2QueryJob(fastjson.loads(response.content), self.client, self.service_url)
+
+    def bulk2_job_state(self, job_id: str) -> Optional[str]:
+        """
+        :return: state of an existing Bulk API 2.0 query job, or None if Salesforce no longer knows about it
+        """
+        response = self.client.get(f'{self.service_url}/services/data/v{_BULK2_API_VERSION}/jobs/query/{job_id}')
+        if response.status_code != 200:
+            return None
+        return fastjson.loads(response.content)['state']
+
+    def bulk2_query(self, soql: str, job_id=None, timeout=3600, job_started: Callable = None,
+                    max_records: int = 0):
+        """
+        Run soql as a Bulk API 2.0 query job, or pick up the results of an existing job if job_id is given.
+        Values are returned as strings, as they are in the CSV results, and nulls as None.
+
+        :param job_started: called with the id of a newly created job, so callers can record it
+        :param max_records: most records per page of results, 0 to let Salesforce decide
+        """
+        yield from self.bulk2_job(soql, job_id, timeout, job_started).results(max_records)
+
+    def bulk2_rows(self, soql: str, job_id=None, timeout=3600, job_started: Callable = None,
+                   max_records: int = 0):
+        """
+        Same as bulk2_query() but yields the CSV rows, starting with the column names, without making
+        records of them.
+        """
+        yield from self.bulk2_job(soql, job_id, timeout, job_started).rows(max_records)
+
+    def bulk2_job(self, soql: str, job_id=None, timeout=3600, job_started: Callable = None) -> Bulk2QueryJob:
+        """
+        Start a Bulk API 2.0 query job, or pick up an existing one, and wait for it to complete.
+        """
+        if job_id is None:
+            job = self.create_query_job(soql)
+            if job_started is not None:
+                job_started(job.job_id)
+            self.log.info(f'Waiting on bulk query job {job.job_id}, timeout is {timeout} seconds')
+        else:
+            job = Bulk2QueryJob({'id': job_id, 'state': 'InProgress'}, self.client, self.service_url)
+            job.refresh()
+        job.wait(timeout)
+        return job
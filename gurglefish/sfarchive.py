@@ -21,6 +21,7 @@ import sys
 from typing import Dict
 
 from gurglefish import tools
+from gurglefish.objects.files import parse_interval
 from gurglefish.schema import SFSchemaManager
 from gurglefish.sfexport import SFExporter
 
@@ -33,10 +34,15 @@ def main():
     group = parser.add_mutually_exclusive_group()
     parser.add_argument("env", help="Environment/DB settings name", metavar="env_name")
     group.add_argument("--sync", help="sync table updates", nargs="*", metavar="sobject|@file")
+    group.add_argument("--daemon", help="keep running, syncing each table on its sync_schedule "
+                                        "(default interval for 'auto' tables is 15m)",
+                       nargs="?", const="15m", metavar="interval")
     group.add_argument("--schema", help="load sobject schema and create tables if missing", nargs="*", metavar="sobject|@file")
     group.add_argument("--export", help="export full sobject data to file", nargs="+", metavar="sobject|@file")
     group.add_argument("--load", help="load/import full table data, table must be empty", nargs="*",
                        metavar="sobject|@file")
+    group.add_argument("--direct-load", help="load full sobject data straight from a bulk query, table must be empty",
+                       nargs="+", metavar="sobject|@file")
     group.add_argument("--dump", help="dump contents of table to file", nargs="+", metavar="table|@file")
     parser.add_argument("--inspect", help="list available sobjects", action="store_true")
     #parser.add_argument("--sample", help="sample data (500 rows)", action="store_true")
@@ -76,6 +82,10 @@ def main():
         exp = SFExporter(context)
         exp.sync_tables(schema_mgr, args.scrub)
 
+    if args.daemon is not None:
+        exp = SFExporter(context)
+        exp.run_daemon(schema_mgr, parse_interval(args.daemon) or 900, args.scrub)
+
     if args.schema is not None:
         if len(args.schema) > 0:
             final_args = tools.make_arg_list(args.schema)
@@ -102,6 +112,14 @@ def main():
             count = imp.bulk_load(tablename)
             logger.info('loaded {} records'.format(count))
 
+    if args.direct_load is not None:
+        imp = SFImporter(context, schema_mgr)
+        for tablename in tools.make_arg_list(args.direct_load):
+            logger.info(f'loading {tablename} from a bulk query')
+            count = imp.direct_load(tablename)
+            if count is not None:
+                logger.info(f'loaded {count} records')
+
 
 if __name__ == '__main__':
     main()
@@ -18,39 +18,64 @@
 import logging
 import os
 import datetime
+import itertools
+import queue as queue_module
 import sys
+import time
+from functools import partial
 from multiprocessing import Process, JoinableQueue, Queue, Value
+from typing import Dict, List, Optional, Set, Tuple
 
 import arrow
 
 from gurglefish import FileManager
 from gurglefish import tools
+from gurglefish.bulkjobs import BulkOrchestrator
+from gurglefish.DriverManager import ROW_HASH_COLUMN
 from gurglefish.context import Context
-from gurglefish.objects.sobject import ColumnMap
+from gurglefish.objects.checkpoint import SyncCheckpoint, KeyRange, SCOPE_SYNC, SCOPE_EXPORT, SCOPE_CURSOR
+from gurglefish.scheduler import TableScheduler, WorkSlots
 from gurglefish.schema import SFSchemaManager
 from gurglefish.objects.files import LocalTableConfig
-from gurglefish.sfapi import SFClient, SFQueryTooLarge
+from gurglefish.pipeline import Pipeline
+from gurglefish.sfapi import SFClient, SFQueryTooLarge, SFQueryLocatorExpired, SFBulkJobFailed, Bulk2QueryJob
+from gurglefish.transformutils import py_timestamp
 
 __author__ = 'mark'
 
+COMMIT_INTERVAL = 10000
+SYNC_ORDER = ' order by SystemModStamp ASC, Id ASC'
+# seconds between the daemon's checks for workers that died
+WORKER_CHECK_INTERVAL = 5
+# longest the daemon waits before trying again after an error
+DAEMON_ERROR_WAIT = 300
+
 
 class ExportThread(Process):
-    def __init__(self, queue: Queue, env_name: str):
+    def __init__(self, queue: Queue, context: Context):
         super().__init__(daemon=True)
         self.queue = queue
-        self.env_name = env_name
-        self.ctx = tools.setup_env(env_name)
+        self.parent_ctx = context
+        self.ctx: Context = None
+        self.schema_mgr: SFSchemaManager = None
+        self.filemgr: FileManager = None
+        self.sfclient: SFClient = None
+
+    def run(self):
+        # connect here, in the worker, so workers start up in parallel
+        self.ctx = tools.worker_env(self.parent_ctx)
         self.schema_mgr = SFSchemaManager(self.ctx)
         self.filemgr = self.ctx.filemgr
         self.sfclient = self.ctx.sfclient
-
-    def run(self):
         db = self.ctx.dbdriver
         log = logging.getLogger(self.name)
         try:
             table_configs = self.ctx.filemgr.get_configured_tables()
-            while not self.queue.empty():
+            while True:
                 job = self.queue.get()
+                if job is None:
+                    self.queue.task_done()
+                    break
                 try:
                     table_name = job['table_name'].lower()
                     just_sample = job['just_sample']
@@ -71,35 +96,66 @@ class ExportThread(Process):
                     total_size = self.ctx.sfclient.record_count(table_name)
 
                     if this_table.use_bulkapi:
-                        if total_size > 200_000:
-                            self.ctx.sfclient.add_header('Sforce-Enable-PKChunking', 'chunkSize=5000')
-                        else:
+                        if this_table.bulkapi_version == 2:
+                            # Salesforce chunks 2.0 jobs itself, and the CSV results have ISO timestamps
                             self.ctx.sfclient.drop_header('Sforce-Enable-PKChunking')
+                            job_state = self.sfclient.bulk2_job_state
+                            resumable = Bulk2QueryJob.STATES_ACTIVE
+                            bulk_query = partial(self.sfclient.bulk2_query,
+                                                 max_records=this_table.bulkapi_max_records)
+                            # CSV results are all strings, booleans and numbers included, unlike the REST api
+                            if not hasattr(self.filemgr.load_translate_handler(table_name), 'parse_csv'):
+                                self.schema_mgr.refresh_transformer(table_name)
+                            results = 'csv'
+                        else:
+                            if 0 < this_table.pk_chunk_threshold < total_size:
+                                self.ctx.sfclient.add_header('Sforce-Enable-PKChunking',
+                                                             f'chunkSize={this_table.pk_chunk_size}')
+                            else:
+                                self.ctx.sfclient.drop_header('Sforce-Enable-PKChunking')
+                            #
+                            # Salesforce does an annoying thing - datetime fields retrieved via bulk api are in
+                            # millis-since-epoch rather than the usual ISO string format. The transformer has a
+                            # parser just for bulk results that converts them directly.
+                            #
+                            if not hasattr(self.filemgr.load_translate_handler(table_name), 'parse_bulk'):
+                                self.schema_mgr.refresh_transformer(table_name)
+                            results = 'bulk'
+                            job_state = self.sfclient.bulk_job_state
+                            resumable = ('Open', 'Closed', 'InProgress')
+                            bulk_query = partial(self.sfclient.bulk_query, table_name,
+                                                 download_threads=this_table.bulkapi_download_threads)
+
                         #
-                        # Salesforce does an annoying thing - datetime fields retrieve via bulk api are in
-                        # millis-since-epoch rather than the usual ISO string format.  So, we need to convert
-                        # them back. Get the map and remove everything but datetime fields (for speed).
+                        # if a previous export was interrupted pick up its bulk job rather than running the
+                        # query again
                         #
-                        colmap: [ColumnMap] = self.ctx.filemgr.get_sobject_map(table_name)
-                        dtmap: [ColumnMap] = list()
-                        for col in iter(colmap):
-                            if col.field_type == 'datetime':
-                                dtmap.append(col)
+                        checkpoint = db.get_checkpoint(table_name, SCOPE_EXPORT)
+                        job_id = None
+                        if checkpoint is not None and checkpoint.bulk_job_id is not None:
+                            if job_state(checkpoint.bulk_job_id) in resumable:
+                                job_id = checkpoint.bulk_job_id
+                                log.info(f'Resuming bulk query job {job_id} for {table_name}')
+                        if job_id is None:
+                            checkpoint = SyncCheckpoint.create(table_name, SCOPE_EXPORT)
 
                         log.info(f'Exporting {total_size} records in {table_name} using bulk query (may take longer)')
-                        with db.create_exporter(table_name, self.ctx, just_sample) as exporter:
-                            for rec in self.ctx.sfclient.bulk_query(table_name, exporter.soql()):
-                                # replace all the numeric timestamps with correct strings
-                                for col in dtmap:
-                                    epoch = rec.get(col.sobject_field, None)
-                                    if epoch is not None:
-                                        dt = datetime.datetime.fromtimestamp(epoch / 1000)
-                                        rec[col.sobject_field] = tools.sf_timestamp(dt)
-                                exporter.write(rec)
+                        try:
+                            with db.create_exporter(table_name, self.ctx, just_sample) as exporter:
+                                write = exporter.write_csv if results == 'csv' else exporter.write_bulk
+                                for rec in bulk_query(exporter.soql(), job_id=job_id,
+                                                      job_started=partial(self.save_bulk_job, checkpoint)):
+                                    write(rec)
+                        except SFBulkJobFailed as ex:
+                            log.error(f'Export of {table_name} failed: {ex}')
+                            continue
+                        with db.cursor as cur:
+                            db.clear_checkpoint(cur, table_name, SCOPE_EXPORT)
+                        db.commit()
                     else:
                         log.info(f'Exporting {table_name}')
                         with db.create_exporter(table_name, self.ctx, just_sample) as exporter:
-                            for rec in self.ctx.sfclient.query(exporter.soql()):
+                            for rec in self.ctx.sfclient.query(exporter.soql(), stream=True):
                                 exporter.write(rec)
 
                                 if exporter.counter % 5000 == 0 and sys.stdout.isatty():
@@ -112,56 +168,141 @@ class ExportThread(Process):
         finally:
             db.close()
 
+    def save_bulk_job(self, checkpoint: SyncCheckpoint, job_id: str):
+        db = self.ctx.dbdriver
+        checkpoint.bulk_job_id = job_id
+        with db.cursor as cur:
+            db.save_checkpoint(cur, checkpoint)
+        db.commit()
+
 
 class SyncThread(Process):
-    def __init__(self, queue: Queue, env_name: str, filemgr: FileManager, sfclient: SFClient, total_calls: Value,
-                 scrub=False):
+    def __init__(self, queue: Queue, context: Context, total_calls: Value, scrub=False, slots: WorkSlots = None,
+                 done: Queue = None):
         super().__init__(daemon=True)
         self.queue = queue
-        self.filemgr = filemgr
-        self.sfclient = sfclient
-        self.env_name = env_name
-
-        self.context = tools.setup_env(env_name)
-        self.schema_mgr = SFSchemaManager(self.context)
-        self.filemgr = self.context.filemgr
-        self.sfclient = self.context.sfclient
+        self.done = done
+        self.parent_ctx = context
+        self.context: Context = None
+        self.schema_mgr: SFSchemaManager = None
+        self.filemgr: FileManager = None
+        self.sfclient: SFClient = None
         self.total_calls: Value = total_calls
         self.force_scrub = scrub
+        self.slots = slots
+        # shared with the daemon, so it can take back the work item and slots of a worker that dies
+        self.item: Value = Value('i', 0)
+        self.held: Value = Value('i', 0)
 
     def run(self):
+        # connect here, in the worker, so workers start up in parallel
+        self.context = tools.worker_env(self.parent_ctx)
+        self.schema_mgr = SFSchemaManager(self.context)
+        self.filemgr = self.context.filemgr
+        self.sfclient = self.context.sfclient
         db = self.context.dbdriver
         log = logging.getLogger(self.name)
         try:
-            while not self.queue.empty():
+            while True:
+                job = self.queue.get()
+                if job is None:
+                    # no more work for this worker
+                    self.queue.task_done()
+                    break
+                self.item.value = job.get('item', 0)
+                # the worker outlives schema changes made by other processes, read the columns afresh
+                db.clear_table_cache()
+                held = 0
+                locked = False
                 try:
                     self.sfclient.calls = 0
-                    job = self.queue.get()
                     jobid = job['jobid']
                     tabledef: LocalTableConfig = job['table']
                     sobject_name = tabledef.name.lower()
+                    key_range: Optional[KeyRange] = job.get('range', None)
+                    governor = self.sfclient.governor
+                    if governor is not None and governor.should_defer(tabledef.priority):
+                        log.warning(f'API usage at {governor.used} of {governor.max} - deferring {sobject_name} '
+                                    'to a later run')
+                        continue
+                    if self.slots is not None:
+                        held = self.slots.acquire(tabledef.weight, self.held)
 
-                    log.info(f'Checking {sobject_name} schema for changes')
-                    proceed = self.schema_mgr.update_sobject_definition(sobject_name,
-                                                                        allow_add=tabledef.auto_create_columns,
-                                                                        allow_drop=tabledef.auto_drop_columns)
-                    if not proceed:
-                        print(f'sync of {sobject_name} skipped due to warnings')
+                    # ranges of the same table may run together, but nothing else while any of them do
+                    locked = db.lock_table(sobject_name, shared=key_range is not None)
+                    if not locked:
+                        log.warning(f'{sobject_name} is already being synced - skipping')
                         continue
 
+                    # ranges of a split table are checked once, before they are queued
+                    if key_range is None:
+                        log.info(f'Checking {sobject_name} schema for changes')
+                        proceed = self.schema_mgr.update_sobject_definition(sobject_name,
+                                                                            allow_add=tabledef.auto_create_columns,
+                                                                            allow_drop=tabledef.auto_drop_columns)
+                        if not proceed:
+                            print(f'sync of {sobject_name} skipped due to warnings')
+                            continue
+
                     timestamp = self.context.dbdriver.max_timestamp(sobject_name)
                     soql = self.context.filemgr.get_sobject_query(sobject_name)
 
                     xlate_handler = self.filemgr.load_translate_handler(sobject_name)
+                    if not hasattr(xlate_handler, 'parse_page'):
+                        self.schema_mgr.refresh_transformer(sobject_name)
+                        xlate_handler = self.filemgr.load_translate_handler(sobject_name)
+                    fingerprint = None
+                    if tabledef.row_fingerprint:
+                        db.enable_row_hash(sobject_name)
+                        fingerprint = xlate_handler.fingerprint_page
                     new_sync = False
-                    if timestamp is not None:
-                        soql += " where SystemModStamp >= {}".format(tools.sf_timestamp(timestamp))
-                        soql += " order by SystemModStamp ASC"
-                        log.info(f'start sync {sobject_name} changes after {timestamp}')
+                    keyset = tabledef.keyset_paging and key_range is None
+                    checkpoint = db.get_checkpoint(sobject_name, SCOPE_SYNC)
+                    if key_range is not None:
+                        checkpoint = db.get_checkpoint(sobject_name, key_range.scope) or \
+                                     SyncCheckpoint.create(sobject_name, key_range.scope)
+                        timestamp = key_range.start
+                        delta_filter = SyncThread.range_filter(key_range, checkpoint.watermark, checkpoint.last_id)
+                        if delta_filter is not None:
+                            soql += ' where ' + delta_filter
+                        soql += SYNC_ORDER
+                        log.info(f'start sync {sobject_name} range {key_range}')
+                        pages = self.resume_pages(soql, checkpoint, not checkpoint.full_sync)
+                    elif checkpoint is not None and checkpoint.watermark is not None:
+                        delta_filter = SyncThread.keyset_filter(checkpoint.watermark, checkpoint.last_id)
+                        log.info(f'resume sync {sobject_name} from checkpoint at {checkpoint.watermark}')
+                        if keyset:
+                            pages = self.keyset_pages(soql, checkpoint.watermark, checkpoint.last_id,
+                                                      tabledef.keyset_chunk_size, not checkpoint.full_sync)
+                        else:
+                            soql += ' where ' + delta_filter + SYNC_ORDER
+                            pages = self.resume_pages(soql, checkpoint, not checkpoint.full_sync)
                     else:
-                        soql += ' order by SystemModStamp ASC'
-                        log.info(f'start full download of {sobject_name}')
-                        new_sync = True
+                        checkpoint = SyncCheckpoint.create(sobject_name, SCOPE_SYNC)
+                        delta_filter = None
+                        watermark, last_id = timestamp, None
+                        if keyset and timestamp is not None:
+                            # start right after the last record of the previous run, if it is still current
+                            cursor = db.get_checkpoint(sobject_name, SCOPE_CURSOR)
+                            if cursor is not None and cursor.watermark is not None and cursor.watermark >= timestamp:
+                                watermark, last_id = cursor.watermark, cursor.last_id
+                        if watermark is not None:
+                            delta_filter = SyncThread.keyset_filter(watermark, last_id)
+                            log.info(f'start sync {sobject_name} changes after {watermark}')
+                        else:
+                            log.info(f'start full download of {sobject_name}')
+                            new_sync = True
+                            checkpoint = SyncCheckpoint.create(sobject_name, SCOPE_SYNC, full_sync=True)
+                        if keyset:
+                            pages = self.keyset_pages(soql, watermark, last_id, tabledef.keyset_chunk_size,
+                                                      not new_sync)
+                        else:
+                            if delta_filter is not None:
+                                soql += ' where ' + delta_filter
+                            soql += SYNC_ORDER
+                            pages = self.sfclient.query_pages(soql, not new_sync)
+                    checkpoint.jobid = jobid
+                    resumed_records = checkpoint.records
                     with db.cursor as cur:
                         counter = 0
                         # journal = self.filemgr.create_journal(sobject_name)
@@ -170,54 +311,200 @@ class SyncThread(Process):
                             inserted = 0
                             updated = 0
                             deleted = 0
-                            for rec in self.sfclient.query(soql, not new_sync):
-                                del rec['attributes']
-                                if rec.get('IsDeleted', False):
-                                    deleted += db.delete(cur, sobject_name, rec['Id'][0:15])
+                            unchanged = 0
+                            committed = 0
+                            last_position = None
+
+                            # the scheduler's estimate, counted when it planned the run or taken from recent runs
+                            delta = int(job.get('records', 0))
+                            staged = delta > tabledef.staging_threshold
+                            if staged:
+                                log.info(f'{sobject_name} expects {delta} changes, applying through staging table')
+                            writer = db.create_sync_writer(cur, sobject_name, self.context,
+                                                           COMMIT_INTERVAL if staged else tabledef.batch_size,
+                                                           staged)
+                            #
+                            # fetching pages, transforming records and writing to the database overlap,
+                            # each running in its own thread
+                            #
+                            pipeline = Pipeline(sobject_name)
+                            pipeline.source('fetch', pages)
+                            pipeline.stage('transform', partial(SyncThread.transform_page, xlate_handler, fingerprint))
+                            for columns, deletes, position in pipeline:
+                                if position[1] is not None:
+                                    last_position = position
+                                if columns is not None:
+                                    writer.write_columns(columns)
+                                for key in deletes:
+                                    writer.delete(key)
+                                if writer.pending < writer.batch_size:
                                     continue
-                                trec = xlate_handler.parse(rec)
-
-                                try:
-                                    i, u = db.upsert(cur, sobject_name, trec, None)
-                                    if i:
-                                        inserted += 1
-                                    if u:
-                                        updated += 1
-                                except Exception as ex:
-                                    # with open('/tmp/debug.json', 'w') as x:
-                                    #     x.write(json.dumps(trec, indent=4, default=tools.json_serial))
-                                    raise ex
-
-                                if i or u:
-                                    counter += 1
-                                    if counter % 5000 == 0:
-                                        log.info(f'{sobject_name} processed {counter}')
-                                    if counter % 10000 == 0:
-                                        db.commit()
+
+                                i, u, d, n = writer.flush()
+                                inserted += i
+                                updated += u
+                                deleted += d
+                                unchanged += n
+                                counter += i + u + d
+                                if counter - committed >= COMMIT_INTERVAL:
+                                    # everything up to the end of this page is applied, remember where that is
+                                    checkpoint.advance(*position)
+                                    checkpoint.records = resumed_records + counter
+                                    db.save_checkpoint(cur, checkpoint)
+                                    db.commit()
+                                    committed = counter
+                                    log.info(f'{sobject_name} processed {counter}')
+
+                            i, u, d, n = writer.flush()
+                            inserted += i
+                            updated += u
+                            deleted += d
+                            unchanged += n
+                            counter += i + u + d
+                            writer.close()
+                            db.clear_checkpoint(cur, sobject_name, checkpoint.scope)
+                            if keyset and last_position is not None:
+                                cursor = SyncCheckpoint.create(sobject_name, SCOPE_CURSOR, jobid)
+                                cursor.advance(*last_position)
+                                db.save_checkpoint(cur, cursor)
                             db.commit()
+                            pipeline.report(log)
 
                             # scrub deleted records
-                            if tabledef.auto_scrub == "always" or self.force_scrub:
+                            # a split table is scrubbed once, by its last range
+                            if (tabledef.auto_scrub == "always" or self.force_scrub) and \
+                                    (key_range is None or key_range.end is None):
                                 deleted += self.scrub_deletes(cur, sobject_name)
 
                             self.total_calls.value += self.sfclient.calls
-                            log.info(f'end sync {sobject_name}: {inserted} inserts, {updated} updates, {deleted} deletes')
+                            log.info(f'end sync {sobject_name}: {inserted} inserts, {updated} updates, {deleted} deletes, '
+                                     f'{unchanged} unchanged')
                             log.info(f'API calls used for {sobject_name}: {self.sfclient.calls}')
 
-                            if counter > 0:
+                            if counter > 0 or unchanged > 0:
                                 db.insert_sync_stats(jobid, sobject_name, sync_start, datetime.datetime.now(), timestamp,
-                                                     inserted, updated, deleted, self.sfclient.calls)
+                                                     inserted, updated, deleted, self.sfclient.calls, unchanged)
                         except SFQueryTooLarge:
                             log.error(f'Query for {sobject_name} too large for REST API - switch to bulkapi to continue')
 
-                        except Exception as ex:
-                            db.rollback()
-                            raise ex
+                        except Exception:
+                            try:
+                                db.rollback()
+                            except Exception as ex:
+                                log.error(f'Rollback of {sobject_name} failed: {ex}')
+                            raise
                 finally:
-                    self.queue.task_done()
+                    # each step runs even if the one before it fails, most likely on a dropped connection
+                    try:
+                        if locked:
+                            db.unlock_table(sobject_name, shared=key_range is not None)
+                    finally:
+                        try:
+                            if held > 0:
+                                self.slots.release(held, self.held)
+                        finally:
+                            self.queue.task_done()
+                            if self.done is not None:
+                                self.done.put(self.item.value)
+                            self.item.value = 0
         finally:
             db.close()
 
+    @staticmethod
+    def keyset_filter(watermark: datetime.datetime, last_id: Optional[str]) -> str:
+        """
+        SOQL condition selecting records after (watermark, last_id) in SystemModStamp, Id order.
+        """
+        stamp = tools.sf_timestamp(watermark)
+        if last_id is None:
+            return f'SystemModStamp >= {stamp}'
+        return f"(SystemModStamp > {stamp} or (SystemModStamp = {stamp} and Id > '{last_id}'))"
+
+    @staticmethod
+    def range_filter(key_range: KeyRange, watermark: Optional[datetime.datetime],
+                     last_id: Optional[str]) -> Optional[str]:
+        """
+        SOQL condition selecting the records of a key range, after (watermark, last_id) if it has been
+        partially synced.
+        """
+        conditions = list()
+        if watermark is not None:
+            conditions.append(SyncThread.keyset_filter(watermark, last_id))
+        elif key_range.start is not None:
+            conditions.append(f'SystemModStamp >= {tools.sf_timestamp(key_range.start)}')
+        if key_range.end is not None:
+            conditions.append(f'SystemModStamp < {tools.sf_timestamp(key_range.end)}')
+        if len(conditions) == 0:
+            return None
+        return ' and '.join(conditions)
+
+    def keyset_pages(self, soql: str, watermark: Optional[datetime.datetime], last_id: Optional[str],
+                     chunk_size: int, include_deleted: bool):
+        """
+        Page through soql in SystemModStamp, Id order using short LIMIT queries, each starting right after
+        the last record of the one before. No boundary record is fetched twice and no query locator is held
+        open between chunks.
+        """
+        while True:
+            query = soql
+            if watermark is not None:
+                query += ' where ' + SyncThread.keyset_filter(watermark, last_id)
+            query += SYNC_ORDER + f' limit {chunk_size}'
+            records = list()
+            for page, _ in self.sfclient.query_pages(query, include_deleted):
+                records.extend(page)
+            if len(records) == 0:
+                return
+            yield records, None
+            if len(records) < chunk_size:
+                return
+            watermark = py_timestamp(records[-1]['SystemModstamp'])
+            last_id = records[-1]['Id']
+
+    def resume_pages(self, soql: str, checkpoint: SyncCheckpoint, include_deleted: bool):
+        """
+        Continue an interrupted sync with its saved query locator, if Salesforce still has it, otherwise
+        with soql which restarts right after the checkpointed record.
+        """
+        if checkpoint.locator is not None:
+            try:
+                for page in self.sfclient.query_pages(None, include_deleted, locator=checkpoint.locator):
+                    yield page
+                return
+            except SFQueryLocatorExpired as ex:
+                logging.getLogger(self.name).info(f'query locator for {checkpoint.table_name} expired ({ex}), '
+                                                  'requerying from checkpoint')
+        for page in self.sfclient.query_pages(soql, include_deleted):
+            yield page
+
+    @staticmethod
+    def transform_page(xlate_handler, fingerprint, page: ([Dict], str)) -> (Optional[Dict[str, List]], [str], tuple):
+        """
+        Transform a page of records from query_pages, a column at a time.
+
+        :return: transformed columns (None if there are no records to write), ids to delete and the checkpoint
+                 position at the end of the page
+        """
+        records, locator = page
+        deletes = list()
+        last_stamp = None
+        last_id = None
+        if len(records) > 0:
+            last_stamp = records[-1].get('SystemModstamp', None)
+            last_id = records[-1]['Id']
+        live = list()
+        for rec in records:
+            if rec.get('IsDeleted', False):
+                deletes.append(rec['Id'][0:15])
+            else:
+                live.append(rec)
+        columns = None
+        if len(live) > 0:
+            columns = xlate_handler.parse_page(live)
+            if fingerprint is not None:
+                columns[ROW_HASH_COLUMN] = fingerprint(columns)
+        return columns, deletes, (locator, last_stamp, last_id)
+
     def scrub_deletes(self, cur, sobject_name: str) -> int:
         db = self.context.dbdriver
         log = logging.getLogger(self.name)
@@ -233,11 +520,11 @@ class SyncThread(Process):
                     left = set(local.readlines())
                     right = set(remote.readlines())
                     ids_to_delete = left - right
-                    for i in ids_to_delete:
-                        db.delete(cur, sobject_name, i.strip())
+                    deleted = db.delete_batch(cur, sobject_name, [i.strip() for i in ids_to_delete])
+                    db.commit()
             os.unlink(sobject_file)
             os.unlink(table_file)
-            return len(ids_to_delete)
+            return deleted
 
         except Exception as ex:
             log.error(ex)
@@ -250,35 +537,31 @@ class SFExporter:
         self.storagedir = context.filemgr.exportdir
         os.makedirs(self.storagedir, exist_ok=True)
         self.log = logging.getLogger('main')
+        self.item_ids = itertools.count(1)
+        self.table_warning: Optional[str] = None
+        # tables synced in ranges, locked by this process until all of their ranges are done
+        self.range_locks: Set[str] = set()
 
     def sync_tables(self, schema_mgr: SFSchemaManager, scrub=False):
-        table_config: [LocalTableConfig] = self.context.filemgr.get_configured_tables()
-        if table_config is None:
-            self.log.error('No configuration found - Use --init to create and then edit')
-            return
-        tablelist: [LocalTableConfig] = [table for table in table_config if table.enabled]
-        if len(tablelist) == 0:
-            self.log.warning('No tables enabled for sync')
+        tablelist = self.enabled_tables()
+        if tablelist is None:
             return
         jobid = self.context.dbdriver.start_sync_job()
         queue: Queue = JoinableQueue()
         try:
-            self.log.info('Building table sync queue')
-            for table in tablelist:
-                tablename = table.name.lower()
-                if not self.context.dbdriver.table_exists(tablename):
-                    schema_mgr.create_table(tablename)
+            self.context.sfclient.calls = 0
+            queued = self.queue_tables(schema_mgr, tablelist, jobid, queue)
 
-                queue.put({'jobid': jobid, 'table': table})
-
-            self.log.info(f'Allocating {self.context.env.threads} thread(s)')
+            thread_count = min(self.context.env.threads, len(queued))
+            self.log.info(f'Allocating {thread_count} thread(s)')
             pool: [SyncThread] = list()
-            total_api_calls: Value = Value('i', 0)
-            for i in range(0, self.context.env.threads):
-                job = SyncThread(queue, self.context.envname, self.context.filemgr, self.context.sfclient,
-                                 total_api_calls, scrub)
+            total_api_calls: Value = Value('i', self.context.sfclient.calls)
+            slots = WorkSlots(thread_count)
+            for i in range(0, thread_count):
+                job = SyncThread(queue, self.context, total_api_calls, scrub, slots)
                 job.start()
                 pool.append(job)
+                queue.put(None)
 
             for t in pool:
                 self.log.debug(f'Waiting on thread {t.name}')
@@ -286,24 +569,239 @@ class SFExporter:
             if not queue.empty():
                 self.log.warning('All threads finished before queue was drained')
             self.log.info(f"Total API calls used during sync: {total_api_calls.value}")
+            governor = self.context.sfclient.governor
+            if governor is not None and governor.max > 0:
+                self.log.info(f'Org API usage: {governor.used} of {governor.max} daily requests')
 
         finally:
+            for tablename in list(self.range_locks):
+                self.release_ranges(tablename)
             self.context.dbdriver.finish_sync_job(jobid)
             self.context.dbdriver.clean_house(arrow.now().shift(months=-2).datetime)
 
+    def run_daemon(self, schema_mgr: SFSchemaManager, default_interval: int, scrub=False):
+        """
+        Sync tables continuously, each on its own sync_schedule, keeping the Salesforce session, database
+        connections and worker processes open between runs. Tables with an 'auto' schedule are synced every
+        default_interval seconds.
+        """
+        queue: Queue = JoinableQueue()
+        done: Queue = Queue()
+        thread_count = self.context.env.threads
+        slots = WorkSlots(thread_count)
+        total_api_calls: Value = Value('i', 0)
+        pool: [SyncThread] = list()
+
+        next_due: Dict[str, float] = dict()
+        running: Dict[str, int] = dict()
+        jobs: Dict[int, int] = dict()
+        pending: Dict[int, Tuple[int, str]] = dict()
+        intervals: Dict[str, int] = dict()
+        last_cleaning = None
+
+        def finished(item: int):
+            # a worker that dies after reporting its item may be reaped too, count the item only once
+            if item not in pending:
+                return
+            jobid, tablename = pending.pop(item)
+            running[tablename] -= 1
+            if running[tablename] == 0:
+                del running[tablename]
+                self.release_ranges(tablename)
+                next_due[tablename] = time.monotonic() + intervals.get(tablename, default_interval)
+            jobs[jobid] -= 1
+            if jobs[jobid] == 0:
+                # left in jobs if this fails, to be finished when the daemon stops
+                self.context.dbdriver.finish_sync_job(jobid)
+                del jobs[jobid]
+
+        errors = 0
+        self.log.info(f'Starting sync daemon with {thread_count} thread(s)')
+        try:
+            while True:
+                try:
+                    # replace any worker that died on an error, taking back what it was working on
+                    for t in pool:
+                        if t.is_alive():
+                            continue
+                        if t.held.value > 0 or t.item.value > 0:
+                            self.log.warning(f'{t.name} exited with exit code {t.exitcode} while syncing - '
+                                             'releasing its work')
+                        slots.reclaim(t.pid, t.held.value)
+                        finished(t.item.value)
+                    pool = [t for t in pool if t.is_alive()]
+                    while len(pool) < thread_count:
+                        job = SyncThread(queue, self.context, total_api_calls, scrub, slots, done)
+                        job.start()
+                        pool.append(job)
+
+                    now = time.monotonic()
+                    tablelist = self.enabled_tables() or list()
+                    due = [table for table in tablelist
+                           if table.name.lower() not in running and next_due.get(table.name.lower(), 0) <= now]
+                    if len(due) > 0:
+                        jobid = self.context.dbdriver.start_sync_job()
+                        try:
+                            queued = self.queue_tables(schema_mgr, due, jobid, queue)
+                        except Exception:
+                            self.context.dbdriver.finish_sync_job(jobid)
+                            raise
+                        for item, tablename in queued.items():
+                            pending[item] = (jobid, tablename)
+                            running[tablename] = running.get(tablename, 0) + 1
+                        if len(queued) > 0:
+                            jobs[jobid] = len(queued)
+                        else:
+                            self.context.dbdriver.finish_sync_job(jobid)
+                        # tables that could not be queued are tried again on their next turn
+                        for table in due:
+                            if table.name.lower() not in running:
+                                next_due[table.name.lower()] = now + (table.sync_interval or default_interval)
+
+                    intervals = dict((table.name.lower(), table.sync_interval or default_interval)
+                                     for table in tablelist)
+                    wake = min([due_time for name, due_time in next_due.items() if name not in running] +
+                               [now + WORKER_CHECK_INTERVAL])
+                    try:
+                        item = done.get(timeout=max(1.0, wake - time.monotonic()))
+                        while True:
+                            finished(item)
+                            item = done.get_nowait()
+                    except queue_module.Empty:
+                        pass
+
+                    today = datetime.date.today()
+                    if last_cleaning != today:
+                        self.context.dbdriver.clean_house(arrow.now().shift(months=-2).datetime)
+                        last_cleaning = today
+                    errors = 0
+                except Exception as ex:
+                    # keep running through a lost connection, an API error or a bad edit to config.json
+                    wait = min(DAEMON_ERROR_WAIT, WORKER_CHECK_INTERVAL * 2 ** errors)
+                    errors += 1
+                    self.log.error(f'Sync daemon error, trying again in {wait}s: {ex}', exc_info=True)
+                    time.sleep(wait)
+                    try:
+                        self.context.dbdriver.reconnect()
+                    except Exception as ex:
+                        self.log.error(f'Unable to reconnect to the database: {ex}')
+        except KeyboardInterrupt:
+            self.log.info('Stopping sync daemon')
+        finally:
+            for _ in pool:
+                queue.put(None)
+            for t in pool:
+                t.join()
+            for jobid in jobs.keys():
+                self.context.dbdriver.finish_sync_job(jobid)
+
+    def enabled_tables(self) -> Optional[List[LocalTableConfig]]:
+        table_config: [LocalTableConfig] = self.context.filemgr.get_configured_tables()
+        if table_config is None:
+            self.warn_once(logging.ERROR, 'No configuration found - Use --init to create and then edit')
+            return None
+        tablelist: [LocalTableConfig] = [table for table in table_config if table.enabled]
+        if len(tablelist) == 0:
+            self.warn_once(logging.WARNING, 'No tables enabled for sync')
+            return None
+        self.table_warning = None
+        return tablelist
+
+    def warn_once(self, level: int, message: str):
+        # the daemon looks at the tables every few seconds, only say so again once something changed
+        if message != self.table_warning:
+            self.log.log(level, message)
+            self.table_warning = message
+
+    def queue_tables(self, schema_mgr: SFSchemaManager, tablelist: [LocalTableConfig], jobid,
+                     queue: Queue) -> Dict[int, str]:
+        """
+        Queue sync work for tables, longest expected first.
+
+        :return: table name of each work item queued, by item id
+        """
+        self.log.info('Building table sync queue')
+        for table in tablelist:
+            tablename = table.name.lower()
+            if not self.context.dbdriver.table_exists(tablename):
+                schema_mgr.create_table(tablename)
+
+        # longest expected syncs go first so they don't hold up the end of the job
+        scheduler = TableScheduler(self.context)
+        checked = dict()
+        queued: Dict[int, str] = dict()
+        # queued only once all are checked, so an error part way leaves nothing behind
+        items = list()
+        try:
+            work = scheduler.plan(tablelist, jobid, self.context.env.threads)
+            for item in work:
+                tablename = item.table.name.lower()
+                if item.key_range is not None:
+                    # all ranges share the table, check its schema here rather than in each worker
+                    if tablename not in checked:
+                        checked[tablename] = schema_mgr.update_sobject_definition(
+                            tablename, allow_add=item.table.auto_create_columns,
+                            allow_drop=item.table.auto_drop_columns)
+                        if not checked[tablename]:
+                            self.log.warning(f'sync of {tablename} skipped due to warnings')
+                    if not checked[tablename]:
+                        continue
+                item_id = next(self.item_ids)
+                items.append({'item': item_id, 'jobid': jobid, 'table': item.table, 'range': item.key_range,
+                              'records': item.records})
+                queued[item_id] = tablename
+        except Exception:
+            for tablename in list(scheduler.claimed):
+                scheduler.release(tablename)
+            raise
+        # the lock on a table planned in ranges is held until the last of them is done
+        self.range_locks.update(scheduler.claimed & set(queued.values()))
+        for tablename in scheduler.claimed - set(queued.values()):
+            scheduler.release(tablename)
+        # end the transaction planning read in, it would hold up schema changes made by the workers
+        self.context.dbdriver.commit()
+        for item in items:
+            queue.put(item)
+        return queued
+
+    def release_ranges(self, tablename: str):
+        if tablename in self.range_locks:
+            self.range_locks.remove(tablename)
+            self.context.dbdriver.unlock_table(tablename, shared=True)
+
     def export_tables(self, table_list: [str], just_sample=False):
+        table_config: [LocalTableConfig] = self.context.filemgr.get_configured_tables()
+        if table_config is None:
+            self.log.error('No configuration found - Use --init to create and then edit')
+            return
+        table_list = [tablename.lower() for tablename in table_list]
         queue: Queue = JoinableQueue()
-        for tablename in table_list:
-            tablename = tablename.lower()
-            queue.put({'table_name': tablename, 'just_sample': just_sample})
 
-        thread_count = min(self.context.env.threads, queue.qsize())
+        thread_count = min(self.context.env.threads, len(table_list))
         self.log.info(f'Allocating {thread_count} thread(s)')
         pool: [ExportThread] = list()
         for i in range(0, thread_count):
-            job = ExportThread(queue, self.context.envname)
+            job = ExportThread(queue, self.context)
             job.start()
             pool.append(job)
+
+        #
+        # start the bulk query jobs of all the tables now so Salesforce runs them side by side, and hand each
+        # table to the workers once its results are ready. Everything else can be exported right away.
+        #
+        orchestrator = BulkOrchestrator(self.context)
+        waiting = list()
+        if not just_sample:
+            bulk_tables = [table for table in table_config
+                           if table.name.lower() in table_list and table.use_bulkapi]
+            waiting = orchestrator.submit(bulk_tables)
+        for tablename in table_list:
+            if tablename not in waiting:
+                queue.put({'table_name': tablename, 'just_sample': just_sample})
+        orchestrator.dispatch(queue, just_sample)
+
+        for _ in pool:
+            queue.put(None)
         for t in pool:
             self.log.debug(f'Waiting on thread {t.name}')
             t.join()
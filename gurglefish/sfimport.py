@@ -14,10 +14,23 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+from typing import Dict, Optional
+
+from gurglefish.csvstream import CopySource
+from gurglefish.objects.checkpoint import SyncCheckpoint, SCOPE_EXPORT
+from gurglefish.objects.sobject import ColumnMap
 from gurglefish.schema import SFSchemaManager
+from gurglefish.sfapi import Bulk2QueryJob
 
 __author__ = 'mark'
 
+# values of these field types are cut to the same length the transformers cut them to
+_CUTS = {'id': 15, 'reference': 15, 'datetime': 19, 'time': 8}
+# text field types, cut to the column length and scrubbed like the transformers do
+_TEXT_TYPES = ('picklist', 'multipicklist', 'string', 'textarea', 'email', 'phone', 'url', 'encryptedstring',
+               'combobox')
+
 
 class SFImporter:
     context = None
@@ -33,3 +46,66 @@ class SFImporter:
             self.schema_mgr.create_table(sobject_name)
 
         return self.context.dbdriver.import_native(sobject_name)
+
+    def direct_load(self, sobject_name) -> Optional[int]:
+        """
+        Load all records of an sobject straight into its table, which must be empty, from a Bulk API 2.0
+        query. The CSV results are streamed into COPY as they download - only Id, datetime, time and text
+        values are touched on the way through.
+
+        :return: number of records loaded, None if the table already has records
+        """
+        sobject_name = sobject_name.lower()
+        db = self.context.dbdriver
+        sfclient = self.context.sfclient
+        log = logging.getLogger('importer')
+
+        if not db.table_exists(sobject_name):
+            self.schema_mgr.create_table(sobject_name)
+        # COPY would fail on the first duplicate Id, after the whole query has run
+        existing = db.record_count(sobject_name)
+        if existing > 0:
+            log.error(f'{sobject_name} already has {existing} records - direct load needs an empty table')
+            return None
+
+        fieldmap: Dict[str, ColumnMap] = dict((f.sobject_field.lower(), f)
+                                              for f in self.context.filemgr.get_sobject_map(sobject_name))
+        soql = f'select {",".join(f.sobject_field for f in fieldmap.values())} from {sobject_name}'
+
+        # pick up the job of an interrupted load or export rather than running the query again
+        checkpoint = db.get_checkpoint(sobject_name, SCOPE_EXPORT)
+        job_id = None
+        if checkpoint is not None and checkpoint.bulk_job_id is not None and \
+                sfclient.bulk2_job_state(checkpoint.bulk_job_id) in Bulk2QueryJob.STATES_ACTIVE:
+            job_id = checkpoint.bulk_job_id
+            log.info(f'Resuming bulk query job {job_id} for {sobject_name}')
+        else:
+            checkpoint = SyncCheckpoint.create(sobject_name, SCOPE_EXPORT)
+
+        def job_started(new_job_id: str):
+            checkpoint.bulk_job_id = new_job_id
+            with db.cursor as cur:
+                db.save_checkpoint(cur, checkpoint)
+            db.commit()
+
+        rows = sfclient.bulk2_rows(soql, job_id=job_id, job_started=job_started)
+        header = next(rows, None)
+        count = 0
+        if header is not None:
+            columns = list()
+            cuts = list()
+            scrubbed = list()
+            for pos, name in enumerate(header):
+                field = fieldmap[name.lower()]
+                columns.append(field.db_field)
+                if field.field_type in _CUTS:
+                    cuts.append((pos, _CUTS[field.field_type]))
+                elif field.field_type in _TEXT_TYPES:
+                    cuts.append((pos, field.fieldlen))
+                    scrubbed.append(pos)
+            count = db.import_csv(sobject_name, columns, CopySource(rows, cuts, scrubbed))
+
+        with db.cursor as cur:
+            db.clear_checkpoint(cur, sobject_name, SCOPE_EXPORT)
+        db.commit()
+        return count
@@ -20,8 +20,9 @@ from typing import Optional
 
 import yaml
 
-from gurglefish import DriverManager
+from gurglefish import DriverManager, fastjson
 from gurglefish.context import Context
+from gurglefish.governor import ApiGovernor
 from gurglefish.objects.connections import Connections, ConnectionConfig
 from gurglefish.sfapi import SFClient
 import logging.config
@@ -40,7 +41,10 @@ def setup_env(envname) -> Optional[Context]:
         _log.error(f'Configuration for {envname} not found')
         exit(1)
 
-    sf = SFClient()
+    if env.json_decoder is not None:
+        fastjson.use(env.json_decoder)
+
+    sf = SFClient(ApiGovernor(env.api_throttle_pct, env.api_pause_pct), env.api_retries)
     try:
         sf.login(env.consumer_key, env.consumer_secret, env.login, env.password, env.authurl)
     except Exception as ex:
@@ -50,6 +54,19 @@ def setup_env(envname) -> Optional[Context]:
     return Context(envname, env, get_db_connection(envname), sf)
 
 
+def worker_env(context: Context) -> Context:
+    """
+    Context for a worker process. It shares the Salesforce session of context, refreshing it for all of
+    them when it expires, and opens its own connection with the same database driver.
+    """
+    parent = context.sfclient
+    sf = SFClient(parent.governor, parent.max_retries)
+    sf.construct(parent.shared_token.value, parent.service_url, parent.credentials, parent.shared_token)
+    driver = type(context.dbdriver)()
+    driver.connect(context.env)
+    return Context(context.envname, context.env, driver, sf)
+
+
 def get_db_connection(envname: str) -> DriverManager.DbDriverMeta:
     mde = Connections()
     env: ConnectionConfig = mde.get_db_env(envname)
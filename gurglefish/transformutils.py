@@ -14,9 +14,14 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with Gurglefish.  If not, see <http://www.gnu.org/licenses/>.
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
 
 import decimal
+import hashlib
+
+from fastcache import lru_cache
+
+_EPOCH = datetime(1970, 1, 1)
 
 
 def id(rec, name, fieldlen):
@@ -57,17 +62,83 @@ def ts(rec, name, fieldlen):
     return None
 
 
+def bulk_ts(rec, name, fieldlen):
+    # bulk api datetimes are millis since the epoch, UTC
+    value = rec.get(name)
+    if value is None:
+        return None
+    return _EPOCH + timedelta(seconds=value // 1000)
+
+
+def bulk_dt(rec, name, fieldlen):
+    value = rec.get(name)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return py_date(value)
+    return (_EPOCH + timedelta(seconds=value // 1000)).date()
+
+
+#
+# Bulk API 2.0 CSV results are all text. Booleans and numbers are typed as the REST API has them, so a
+# record exported from CSV gets the same fingerprint as when it is synced.
+#
+
+def csv_number(text: str):
+    # as a JSON parser reads the same number
+    if '.' in text or 'e' in text or 'E' in text:
+        return float(text)
+    return int(text)
+
+
+def csv_bl(rec, name, fieldlen):
+    value = rec.get(name)
+    if value is None:
+        return None
+    return value == 'true'
+
+
+def csv_inte(rec, name, fieldlen):
+    value = rec.get(name)
+    if value is None:
+        return None
+    return csv_number(value)
+
+
+def csv_db(rec, name, fieldlen):
+    value = rec.get(name)
+    if value is None:
+        return None
+    return truncate_number(csv_number(value), fieldlen)
+
+
 def db(rec, name, fieldlen):
     if name in rec and rec[name] is not None:
-        d = decimal.Decimal(rec[name])
-        s = str(d)
-        if 0 < fieldlen < len(s):
-            # truncate
-            return float(s[0:fieldlen])
-        return rec[name]
+        return truncate_number(rec[name], fieldlen)
     return None
 
 
+def truncate_number(value, fieldlen):
+    if fieldlen <= 0:
+        return value
+    if value.__class__ is float and not -1e16 < value < 1e16:
+        # written in exponent form, these never fit as they are - go straight to the exact decimal form
+        s = str(decimal.Decimal(value))
+        if fieldlen < len(s):
+            return float(s[0:fieldlen])
+        return value
+    # nearly every value fits as it is, only work out the exact decimal form of ones that may not
+    text = value if value.__class__ is str else repr(value)
+    if len(text) <= fieldlen and 'e' not in text and 'E' not in text:
+        return value
+    d = decimal.Decimal(value)
+    s = str(d)
+    if 0 < fieldlen < len(s):
+        # truncate
+        return float(s[0:fieldlen])
+    return value
+
+
 def st(rec, name, fieldlen=0):
     if name in rec and rec[name] is not None:
         node = rec[name]
@@ -85,16 +156,89 @@ def stsub(rec, name, subname, fieldlen=0):
     return None
 
 
+#
+# Column versions of the helpers above, used by parse_page() to convert a whole page of values of one field
+# (None where missing) at a time.
+#
+
+def id_col(values, fieldlen):
+    return [v[0:15] if v is not None and len(v) > 15 else v for v in values]
+
+
+def dt_col(values, fieldlen):
+    return [py_date(v) if v is not None else None for v in values]
+
+
+def tm_col(values, fieldlen):
+    return [py_time(v) if v is not None else None for v in values]
+
+
+def ts_col(values, fieldlen):
+    return [py_timestamp(v) if v is not None else None for v in values]
+
+
+def db_col(values, fieldlen):
+    return [truncate_number(v, fieldlen) if v is not None else None for v in values]
+
+
+def st_col(values, fieldlen=0):
+    return [scrub(v[0:fieldlen]) if v is not None else None for v in values]
+
+
+#
+# Used by copy_line() to write values as COPY text (postgres text format) straight from the record.
+#
+
+def copy_text(s):
+    s = scrub(s)
+    if '\\' in s or '\n' in s or '\r' in s or '\t' in s:
+        s = s.replace('\\', '\\\\')
+        s = s.replace('\n', '\\n')
+        s = s.replace('\r', '\\r')
+        s = s.replace('\t', '\\t')
+    return s
+
+
+def copy_number(value, fieldlen):
+    value = truncate_number(value, fieldlen)
+    return copy_text(value) if value.__class__ is str else str(value)
+
+
+#
+# Salesforce always sends ISO 8601, which fromisoformat() parses many times faster than strptime(). Python 3.6
+# doesn't have it, so there the fields are sliced out by position.
+#
+if hasattr(datetime, 'fromisoformat'):
+    _iso_timestamp = datetime.fromisoformat
+    _iso_date = date.fromisoformat
+    _iso_time = time.fromisoformat
+else:
+    def _iso_timestamp(t) -> datetime:
+        return datetime(int(t[0:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]), int(t[14:16]), int(t[17:19]))
+
+    def _iso_date(d) -> date:
+        return date(int(d[0:4]), int(d[5:7]), int(d[8:10]))
+
+    def _iso_time(t) -> time:
+        return time(int(t[0:2]), int(t[3:5]), int(t[6:8]))
+
+
 def py_timestamp(t) -> datetime:
-    return datetime.strptime(t[0:19], '%Y-%m-%dT%H:%M:%S')
+    return _iso_timestamp(t[0:19])
 
 
+# the same few dates (close dates, birthdays, ...) come up over and over
+@lru_cache(maxsize=1024)
 def py_date(d) -> date:
-    return datetime.strptime(d, '%Y-%m-%d').date()
+    return _iso_date(d)
 
 
 def py_time(t) -> time:
-    return datetime.strptime(t[0:8], "%H:%M:%S").time()
+    return _iso_time(t[0:8])
+
+
+def row_hash(values: tuple) -> str:
+    return hashlib.md5(repr(values).encode('utf-8')).hexdigest()
 
 
 def scrub(s):
@@ -27,6 +27,7 @@ setuptools.setup(
 #    data_files=[('share/doc/gurglefish', ['README.md', 'LICENSE' ]), ('config', ['gurglefish/logging.yml'])],
     packages=setuptools.find_packages(),
     install_requires=['requests==2.31.0', 'psycopg2-binary==2.8', 'fastcache==1.0.2', 'arrow==0.15.1', 'python-dateutil==2.8.0', 'pyyaml==5.1'],
+    extras_require={'async': ['aiohttp>=3.6']},
     entry_points={"console_scripts": ["gurglefish=gurglefish.sfarchive:main"]},
     classifiers=[
       'Programming Language :: Python :: 3',